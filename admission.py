@@ -0,0 +1,184 @@
+import itertools
+import threading
+import time
+from flask import g, jsonify, request
+from metrics import add_timing, metrics
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# never queued, so the service can still be watched under overload
+EXEMPT_ENDPOINTS = ('prometheus_metrics', 'static')
+
+'''
+_Waiter
+    a queued request, ordered by priority (reads before writes), then
+    arrival
+'''
+class _Waiter:
+    def __init__(self, route, priority, limit, seq):
+        self.route = route
+        self.priority = priority
+        self.limit = limit
+        self.seq = seq
+        self.granted = False
+        self.event = threading.Event()
+
+    def key(self):
+        return self.priority, self.seq
+
+'''
+AdmissionLimiter
+    bounds the requests running at once in this process, overall
+    (max_in_flight) and per route (limit given to acquire)
+    requests that can't start wait in a bounded queue, the first
+    waiter that fits is let in whenever a request finishes, reads
+    before writes
+    a full queue sheds its lowest priority request: the newcomer, or
+    the newest queued write when a read arrives
+'''
+class AdmissionLimiter:
+    def __init__(self, max_in_flight=8, queue_size=24):
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self.configure(max_in_flight, queue_size)
+        self.reset()
+
+    def configure(self, max_in_flight, queue_size):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+
+    def reset(self):
+        with self._lock:
+            self.in_flight = {}
+            self.total = 0
+            self.waiters = []
+            self.admitted = {}
+            self.shed = {}
+
+    def _fits(self, route, limit):
+        return self.total < self.max_in_flight and \
+            (limit is None or self.in_flight.get(route, 0) < limit)
+
+    def _start(self, route):
+        self.total += 1
+        self.in_flight[route] = self.in_flight.get(route, 0) + 1
+        self.admitted[route] = self.admitted.get(route, 0) + 1
+
+    def _shed(self, route, reason):
+        self.shed[route, reason] = self.shed.get((route, reason), 0) + 1
+
+    def try_acquire(self, route, limit=None):
+        with self._lock:
+            if self._fits(route, limit):
+                self._start(route)
+                return True
+            return False
+
+    def acquire(self, route, priority=0, limit=None, timeout=None):
+        with self._lock:
+            if self._fits(route, limit):
+                self._start(route)
+                return True
+
+            waiter = _Waiter(route, priority, limit, next(self._seq))
+            if len(self.waiters) >= self.queue_size:
+                worst = max(self.waiters, key=_Waiter.key, default=None)
+                if worst is None or worst.priority <= priority:
+                    self._shed(route, 'queue_full')
+                    return False
+                self.waiters.remove(worst)
+                self._shed(worst.route, 'evicted')
+                worst.event.set()
+            self.waiters.append(waiter)
+
+        if waiter.event.wait(timeout):
+            return waiter.granted
+
+        with self._lock:
+            if waiter.granted:
+                return True
+            self.waiters.remove(waiter)
+            self._shed(route, 'timeout')
+            return False
+
+    def release(self, route):
+        with self._lock:
+            self.total -= 1
+            self.in_flight[route] -= 1
+            for waiter in sorted(self.waiters, key=_Waiter.key):
+                if self._fits(waiter.route, waiter.limit):
+                    self.waiters.remove(waiter)
+                    self._start(waiter.route)
+                    waiter.granted = True
+                    waiter.event.set()
+
+    def samples(self):
+        with self._lock:
+            in_flight = sorted(self.in_flight.items())
+            admitted = sorted(self.admitted.items())
+            shed = sorted(self.shed.items())
+            depth = len(self.waiters)
+        return [
+            ('madb_admission_in_flight', 'gauge', 'Requests running, by route.',
+             [({'route': route}, count) for route, count in in_flight]),
+            ('madb_admission_queue_depth', 'gauge', 'Requests waiting to start.',
+             [({}, depth)]),
+            ('madb_admission_admitted_total', 'counter', 'Requests let in, by route.',
+             [({'route': route}, count) for route, count in admitted]),
+            ('madb_admission_shed_total', 'counter',
+             'Requests answered 503 by admission control, by route and reason.',
+             [({'route': route, 'reason': reason}, count) for (route, reason), count in shed]),
+        ]
+
+
+limiter = AdmissionLimiter()
+metrics.collectors.append(limiter.samples)
+
+'''
+init_admission(app)
+    runs every request of app through the limiter
+    - ADMISSION_MAX_IN_FLIGHT / ADMISSION_QUEUE_SIZE: requests running
+      at once and waiting in this process
+    - ADMISSION_ROUTE_LIMITS: endpoint -> most requests of that endpoint
+      running at once, ADMISSION_WRITE_LIMIT applies to every other
+      POST, PATCH and DELETE endpoint
+    - ADMISSION_QUEUE_TIMEOUT: seconds a request waits before it is shed
+    shed requests get a 503 with Retry-After (ADMISSION_RETRY_AFTER)
+'''
+def init_admission(app):
+    limiter.configure(app.config['ADMISSION_MAX_IN_FLIGHT'], app.config['ADMISSION_QUEUE_SIZE'])
+
+    @app.before_request
+    def admit():
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        read = request.method in READ_METHODS
+        limit = app.config['ADMISSION_ROUTE_LIMITS'].get(request.endpoint)
+        if limit is None and not read:
+            limit = app.config['ADMISSION_WRITE_LIMIT']
+
+        admitted = limiter.try_acquire(route, limit)
+        if not admitted:
+            start = time.perf_counter()
+            admitted = limiter.acquire(route, 0 if read else 1, limit,
+                                       app.config['ADMISSION_QUEUE_TIMEOUT'])
+            add_timing('queue', time.perf_counter() - start)
+        if not admitted:
+            response = jsonify({
+                'success': False,
+                'error': 503,
+                'message': 'service unavailable'
+            })
+            response.status_code = 503
+            response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+            return response
+
+        g.admitted_route = route
+        return None
+
+    @app.teardown_request
+    def release(exception=None):
+        route = g.pop('admitted_route', None)
+        if route is not None:
+            limiter.release(route)
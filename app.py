@@ -1,14 +1,67 @@
 import os
-from flask import Flask, request, abort, jsonify, render_template
+from flask import Flask, request, abort, jsonify, make_response, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from models import db, db_drop_and_create_all, setup_db, Actor, Movie
-from auth import AuthError, requires_auth
+from sqlalchemy.orm import selectinload
+from models import (db, database_path, db_drop_and_create_all, setup_db, bulk_insert, catalog_stats,
+                    delete_row, delete_rows, update_row, update_rows, Actor, Movie, Casting)
+from admission import init_admission
+from auth import AuthError, check_permissions, requires_auth, jwks_store
+from batch import ACTOR_FIELDS, MOVIE_FIELDS, get_batch, get_batch_ids, get_batch_updates
+from cache import cached, response_cache
+from compression import init_compression
+from conditional import conditional
+from metrics import init_metrics
+from filters import (ACTOR_SORTS, MOVIE_SORTS, ACTOR_COLUMNS, MOVIE_COLUMNS, filter_actors,
+                     filter_movies, formatter, get_fields, get_sort, include_cast, select_fields)
+from pagination import order_by, paginate, total_count
+from replicas import init_replicas
+from search import search
+from serializers import fast_jsonify, select_rows
+from streaming import stream_format, stream_query
 
 def create_app(test_config=None):
     app = Flask(__name__)
-    setup_db(app)
-    CORS(app)
+    app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 100))
+    app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+    app.config['RESPONSE_CACHE'] = os.environ.get('RESPONSE_CACHE', 'lru')
+    app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    app.config['RESPONSE_CACHE_REDIS_URL'] = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    app.config['COMPRESSION_LEVEL'] = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    app.config['COMPRESSION_BROTLI_LEVEL'] = int(os.environ.get('COMPRESSION_BROTLI_LEVEL', 4))
+    app.config['ADMISSION_MAX_IN_FLIGHT'] = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 8))
+    app.config['ADMISSION_QUEUE_SIZE'] = int(os.environ.get('ADMISSION_QUEUE_SIZE', 24))
+    app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+    app.config['ADMISSION_WRITE_LIMIT'] = int(os.environ.get('ADMISSION_WRITE_LIMIT', 4))
+    app.config['ADMISSION_ROUTE_LIMITS'] = {
+        endpoint: int(limit) for endpoint, limit in (
+            item.split('=') for item in os.environ.get('ADMISSION_ROUTE_LIMITS', '').split(',') if item)}
+    app.config['ADMISSION_RETRY_AFTER'] = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+    app.config['REPLICA_PIN_SECONDS'] = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+    app.config['REPLICA_CHECK_INTERVAL'] = int(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+    app.config['DATABASE_REPLICA_URLS'] = [
+        path for path in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if path]
+    # test_config overrides any of the settings above, plus the database
+    # (SQLALCHEMY_DATABASE_URI) and the key set tokens are checked with
+    # (JWKS_URL)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+             replica_paths=app.config['DATABASE_REPLICA_URLS'])
+    CORS(app, expose_headers=['X-Total-Count'])
+    init_metrics(app)
+    init_admission(app)
+    init_compression(app)
+    init_replicas(app)
+    response_cache.init_app(app)
+    if 'JWKS_URL' in app.config:
+        jwks_store.configure(url=app.config['JWKS_URL'])
+    jwks_store.prefetch()
     #db_drop_and_create_all()
 
     '''
@@ -22,19 +75,81 @@ def create_app(test_config=None):
     '''
     Actor routes
     '''
-    # get all actors
+    # get actors, one page at a time, HEAD for the count only
     @app.route('/actors')
     @requires_auth('get:actors')
+    @conditional('actors', cast=('castings', 'movies'))
+    @cached
     def get_actors(payload):
-        actors = Actor.query.all()
-        if len(actors) == 0:
+        query = filter_actors(Actor.query)
+        sort = get_sort(ACTOR_SORTS)
+
+        fields = get_fields(ACTOR_COLUMNS)
+        # counted for HEAD and the first page only, so following pages of
+        # a filtered list don't each pay for a COUNT
+        total = None
+        if request.method == 'HEAD' or 'after' not in request.args:
+            total = total_count(query, 'actors')
+        if request.method == 'HEAD':
+            # the count, plus a single id to tell an empty list like GET does
+            if query.with_entities(Actor.id).first() is None:
+                abort(404)
+            # headers of the GET response, without its body
+            response = make_response('', 200, {'X-Total-Count': total})
+            response.mimetype = app.config['JSONIFY_MIMETYPE']
+            return response
+
+        if include_cast():
+            if fields is not None:
+                query = select_fields(query, ACTOR_COLUMNS, fields, sort)
+            # one batched query for the castings of the whole page
+            query = query.options(
+                selectinload(Actor.castings).joinedload(Casting.movie))
+            format_actor = formatter(fields, cast=True)
+        else:
+            # plain row tuples, no ORM instances
+            query, format_actor = select_rows(query, ACTOR_COLUMNS, fields, sort)
+
+        fmt = stream_format()
+        if fmt is not None:
+            response = stream_query(order_by(query, Actor, sort), 'actors', fmt, format_actor)
+            if total is not None:
+                response.headers['X-Total-Count'] = total
+            return response
+
+        actors, next_cursor = paginate(query, Actor, sort)
+        if not actors:
             abort(404)
 
-        actors = [actor.format() for actor in actors]
+        actors = [format_actor(actor) for actor in actors]
+
+        response = fast_jsonify({
+            'success': True,
+            'actors': actors,
+            'next': next_cursor
+        })
+        if total is not None:
+            response.headers['X-Total-Count'] = total
+        return response, 200
+
+    # get actor
+    @app.route('/actors/<int:actor_id>')
+    @requires_auth('get:actors')
+    @conditional('actors')
+    @cached
+    def get_actor(payload, actor_id):
+        fields = get_fields(ACTOR_COLUMNS)
+        query = Actor.query
+        if fields is not None:
+            query = select_fields(query, ACTOR_COLUMNS, fields)
+        actor = query.filter_by(id=actor_id).one_or_none()
+
+        if actor is None:
+            abort(404)
 
         return jsonify({
             'success': True,
-            'actors': actors
+            'actor': formatter(fields)(actor)
         }), 200
 
     # add actor
@@ -59,69 +174,179 @@ def create_app(test_config=None):
         except:
             abort(422)
 
-    # update actor
-    @app.route('/actors/<int:actor_id>', methods=['PATCH'])
-    @requires_auth('patch:actors')
-    def update_actor(payload, actor_id):
-        name = request.get_json().get('name')
-        gender = request.get_json().get('gender')
-        age = request.get_json().get('age')
-        
-        actor = Actor.query.filter_by(id=actor_id).one_or_none()
-
-        if actor is None:
-            abort(404)
+    # add actors in bulk
+    @app.route('/actors/batch', methods=['POST'])
+    @requires_auth('post:actors')
+    def add_actors(payload):
+        actors = get_batch(ACTOR_FIELDS)
 
         try:
-            actor.name = name
-            actor.gender = gender
-            actor.age = age
-            actor.update()
+            ids = bulk_insert(Actor, actors)
 
             return jsonify({
                 'success': True,
-                'actor': actor.format()
+                'actors': ids
             }), 200
 
         except:
+            db.session.rollback()
             abort(422)
 
-    # delete actor
-    @app.route('/actors/<int:actor_id>', methods=['DELETE'])
+    # update actors in bulk
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actors(payload):
+        items = get_batch_updates(ACTOR_FIELDS)
+
+        try:
+            updated = update_rows(Actor, items)
+        except:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'actors': [{'id': item['id'], 'status': 'updated' if item['id'] in updated else 'not_found'}
+                       for item in items]
+        }), 200
+
+    # delete actors in bulk
+    @app.route('/actors', methods=['DELETE'])
     @requires_auth('delete:actors')
-    def delete_actor(payload, actor_id):
-        actor = Actor.query.filter_by(id=actor_id).one_or_none()
+    def delete_actors(payload):
+        ids = get_batch_ids()
+
+        try:
+            deleted = delete_rows(Actor, ids)
+        except:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'actors': [{'id': actor_id, 'status': 'deleted' if actor_id in deleted else 'not_found'}
+                       for actor_id in ids]
+        }), 200
+
+    # update actor
+    @app.route('/actors/<int:actor_id>', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actor(payload, actor_id):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)
+        values = {field: body[field] for field in ('name', 'gender', 'age') if field in body}
+
+        try:
+            actor = update_row(Actor, actor_id, values)
+        except:
+            db.session.rollback()
+            abort(422)
 
         if actor is None:
             abort(404)
 
+        return jsonify({
+            'success': True,
+            'actor': actor
+        }), 200
+
+    # delete actor
+    @app.route('/actors/<int:actor_id>', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actor(payload, actor_id):
         try:
-            actor.delete()
-            
-            return jsonify({
-                'success': True,
-                'actor': actor_id
-            }), 200
+            deleted = delete_row(Actor, actor_id)
         except:
+            db.session.rollback()
             abort(422)
 
+        if not deleted:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'actor': actor_id
+        }), 200
+
     '''
     Movie routes
     '''
-    # get all movies
+    # get movies, one page at a time, HEAD for the count only
     @app.route('/movies')
     @requires_auth('get:movies')
+    @conditional('movies', cast=('castings', 'actors'))
+    @cached
     def get_movies(payload):
-        movies = Movie.query.all()
+        query = filter_movies(Movie.query)
+        sort = get_sort(MOVIE_SORTS)
+
+        fields = get_fields(MOVIE_COLUMNS)
+        # counted for HEAD and the first page only, so following pages of
+        # a filtered list don't each pay for a COUNT
+        total = None
+        if request.method == 'HEAD' or 'after' not in request.args:
+            total = total_count(query, 'movies')
+        if request.method == 'HEAD':
+            # the count, plus a single id to tell an empty list like GET does
+            if query.with_entities(Movie.id).first() is None:
+                abort(404)
+            # headers of the GET response, without its body
+            response = make_response('', 200, {'X-Total-Count': total})
+            response.mimetype = app.config['JSONIFY_MIMETYPE']
+            return response
+
+        if include_cast():
+            if fields is not None:
+                query = select_fields(query, MOVIE_COLUMNS, fields, sort)
+            # one batched query for the cast of the whole page
+            query = query.options(
+                selectinload(Movie.cast).joinedload(Casting.actor))
+            format_movie = formatter(fields, cast=True)
+        else:
+            # plain row tuples, no ORM instances
+            query, format_movie = select_rows(query, MOVIE_COLUMNS, fields, sort)
+
+        fmt = stream_format()
+        if fmt is not None:
+            response = stream_query(order_by(query, Movie, sort), 'movies', fmt, format_movie)
+            if total is not None:
+                response.headers['X-Total-Count'] = total
+            return response
+
+        movies, next_cursor = paginate(query, Movie, sort)
+        if not movies:
+            abort(404)
+
+        movies = [format_movie(movie) for movie in movies]
 
-        if len(movies) == 0:
+        response = fast_jsonify({
+            'success': True,
+            'movies': movies,
+            'next': next_cursor
+        })
+        if total is not None:
+            response.headers['X-Total-Count'] = total
+        return response, 200
+
+    # get movie
+    @app.route('/movies/<int:movie_id>')
+    @requires_auth('get:movies')
+    @conditional('movies')
+    @cached
+    def get_movie(payload, movie_id):
+        fields = get_fields(MOVIE_COLUMNS)
+        query = Movie.query
+        if fields is not None:
+            query = select_fields(query, MOVIE_COLUMNS, fields)
+        movie = query.filter_by(id=movie_id).one_or_none()
+
+        if movie is None:
             abort(404)
-        
-        movies = [movie.format() for movie in movies]
 
         return jsonify({
             'success': True,
-            'movies': movies
+            'movie': formatter(fields)(movie)
         }), 200
 
     # add movie
@@ -145,51 +370,241 @@ def create_app(test_config=None):
         except:
             abort(422)
 
+    # add movies in bulk
+    @app.route('/movies/batch', methods=['POST'])
+    @requires_auth('post:movies')
+    def add_movies(payload):
+        movies = get_batch(MOVIE_FIELDS)
+
+        try:
+            ids = bulk_insert(Movie, movies)
+
+            return jsonify({
+                'success': True,
+                'movies': ids
+            }), 200
+
+        except:
+            db.session.rollback()
+            abort(422)
+
+    # update movies in bulk
+    @app.route('/movies', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    def update_movies(payload):
+        items = get_batch_updates(MOVIE_FIELDS)
+
+        try:
+            updated = update_rows(Movie, items)
+        except:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'movies': [{'id': item['id'], 'status': 'updated' if item['id'] in updated else 'not_found'}
+                       for item in items]
+        }), 200
+
+    # delete movies in bulk
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies(payload):
+        ids = get_batch_ids()
+
+        try:
+            deleted = delete_rows(Movie, ids)
+        except:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'movies': [{'id': movie_id, 'status': 'deleted' if movie_id in deleted else 'not_found'}
+                       for movie_id in ids]
+        }), 200
+
     # update movie
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def update_movie(payload, movie_id):
-        title = request.get_json().get('title')
-        year = request.get_json().get('year')
-        
-        movie = Movie.query.filter_by(id=movie_id).one_or_none()
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)
+        values = {field: body[field] for field in ('title', 'year') if field in body}
+
+        try:
+            movie = update_row(Movie, movie_id, values)
+        except:
+            db.session.rollback()
+            abort(422)
 
         if movie is None:
             abort(404)
 
+        return jsonify({
+            'success': True,
+            'movie': movie
+        }), 200
+
+    # delete movie
+    @app.route('/movies/<int:movie_id>', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movie(payload, movie_id):
         try:
-            movie.title = title
-            movie.year = year
-            movie.update()
+            deleted = delete_row(Movie, movie_id)
+        except:
+            db.session.rollback()
+            abort(422)
+
+        if not deleted:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'movie': movie_id
+        })
+
+    '''
+    Casting routes
+    '''
+    # get the cast of a movie
+    @app.route('/movies/<int:movie_id>/cast')
+    @requires_auth('get:movies')
+    @conditional('movies', 'castings', 'actors')
+    @cached
+    def get_movie_cast(payload, movie_id):
+        movie = Movie.query.options(
+            selectinload(Movie.cast).joinedload(Casting.actor)
+        ).filter_by(id=movie_id).one_or_none()
+
+        if movie is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'movie': movie_id,
+            'cast': movie.format_cast()
+        }), 200
+
+    # get the movies an actor is cast in
+    @app.route('/actors/<int:actor_id>/movies')
+    @requires_auth('get:actors')
+    @conditional('actors', 'castings', 'movies')
+    @cached
+    def get_actor_movies(payload, actor_id):
+        actor = Actor.query.options(
+            selectinload(Actor.castings).joinedload(Casting.movie)
+        ).filter_by(id=actor_id).one_or_none()
+
+        if actor is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'actor': actor_id,
+            'movies': actor.format_cast()
+        }), 200
+
+    # cast an actor in a movie
+    @app.route('/movies/<int:movie_id>/cast', methods=['POST'])
+    @requires_auth('patch:movies')
+    def add_casting(payload, movie_id):
+        actor_id = request.get_json().get('actor_id')
+        role = request.get_json().get('role')
+
+        if not isinstance(actor_id, int):
+            abort(400)
+
+        if Movie.query.get(movie_id) is None or Actor.query.get(actor_id) is None:
+            abort(404)
+
+        try:
+            Casting(movie_id=movie_id, actor_id=actor_id, role=role).insert()
 
             return jsonify({
                 'success': True,
-                'movie': movie.format()
+                'movie': movie_id,
+                'actor': actor_id
             }), 200
 
         except:
+            db.session.rollback()
             abort(422)
 
-    # delete movie
-    @app.route('/movies/<int:movie_id>', methods=['DELETE'])
-    @requires_auth('delete:movies')
-    def delete_movie(payload, movie_id):
-        movie = Movie.query.filter_by(id=movie_id).one_or_none()
+    # remove an actor from the cast of a movie
+    @app.route('/movies/<int:movie_id>/cast/<int:actor_id>', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    def delete_casting(payload, movie_id, actor_id):
+        casting = Casting.query.get((movie_id, actor_id))
 
-        if movie is None:
+        if casting is None:
             abort(404)
-        
+
         try:
-            movie.delete()
+            casting.delete()
 
             return jsonify({
                 'success': True,
-                'movie': movie_id
-            })
-        
+                'movie': movie_id,
+                'actor': actor_id
+            }), 200
+
         except:
             abort(422)
 
+    '''
+    Search route
+    '''
+    # ranked full-text search over actor names and movie titles
+    @app.route('/search')
+    @requires_auth('get:actors')
+    @conditional('actors', 'movies')
+    @cached
+    def search_catalog(payload):
+        check_permissions('get:movies', payload)
+
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400)
+
+        hits, next_cursor = search(q)
+        if len(hits) == 0:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'hits': hits,
+            'next': next_cursor
+        }), 200
+
+    '''
+    Stats route
+    '''
+    # actor and movie counts, overall and per bucket, read from catalog_stats
+    @app.route('/stats')
+    @requires_auth('get:actors')
+    @conditional('actors', 'movies')
+    @cached
+    def get_catalog_stats(payload):
+        check_permissions('get:movies', payload)
+
+        return jsonify({
+            'success': True,
+            'stats': catalog_stats()
+        }), 200
+
+    '''
+    Cache route
+    '''
+    # response cache hit/miss/eviction counters
+    @app.route('/cache/stats')
+    def cache_stats():
+        return jsonify({
+            'success': True,
+            'cache': response_cache.stats()
+        }), 200
+
     '''
     Error Handlers
     '''
@@ -209,6 +624,14 @@ def create_app(test_config=None):
             "message": "resource not found"
         }), 404
 
+    @app.errorhandler(413)
+    def payload_too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": "payload too large"
+        }), 413
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
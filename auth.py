@@ -1,12 +1,30 @@
+import hashlib
 import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
+from metrics import metrics, timed
 
 AUTH0_DOMAIN = 'coldice.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'casting-agency'
+JWKS_URL = os.environ.get(
+    'JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+# seconds a fetched key set stays fresh when Auth0 sends no max-age
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+# lower bound between two fetches, whatever triggers them
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_TIMEOUT = int(os.environ.get('JWKS_TIMEOUT', 5))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+logger = logging.getLogger(__name__)
 
 '''
 AuthError Exception
@@ -62,29 +80,132 @@ def check_permissions(permission, payload):
 
     return True
 
+'''
+JWKS key store
+    process-wide cache of the Auth0 signing keys, indexed by kid
+    - keys are fetched once and kept for JWKS_TTL seconds, or for the
+      max-age Auth0 sends in Cache-Control
+    - expired keys keep being served while a single background thread
+      refreshes them, requests only wait for Auth0 when no key was ever
+      fetched
+    - an unknown kid triggers a single refresh shared by all threads
+    - when a refresh fails the previously fetched keys keep being served
+'''
+class JWKSStore:
+    def __init__(self, url=JWKS_URL, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.fetches = 0
+        self._expires_at = 0
+        self._last_attempt = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self.background = None
+
+    def configure(self, url=None, ttl=None):
+        with self._lock:
+            if url is not None and url != self.url:
+                self.url = url
+                self.keys = {}
+                self._expires_at = 0
+                self._last_attempt = None
+            if ttl is not None:
+                self.ttl = ttl
+
+    def _max_age(self, cache_control):
+        if not cache_control:
+            return self.ttl
+        if re.search(r'no-(cache|store)', cache_control):
+            return 0
+        match = re.search(r'max-age=(\d+)', cache_control)
+        if match is None:
+            return self.ttl
+        return int(match.group(1))
+
+    def _fetch(self):
+        response = urlopen(self.url, timeout=self.timeout)
+        jwks = json.loads(response.read())
+        keys = {key['kid']: {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        } for key in jwks['keys'] if 'kid' in key}
+        max_age = self._max_age(response.headers.get('Cache-Control'))
+        return keys, max_age
+
+    def refresh(self, generation=None):
+        if generation is None:
+            generation = self._generation
+        with self._lock:
+            # another thread attempted a refresh while we were waiting for it
+            if self._generation != generation:
+                return
+            now = time.monotonic()
+            self._last_attempt = now
+            self.fetches += 1
+            try:
+                keys, max_age = self._fetch()
+            except Exception as error:
+                logger.warning('Unable to refresh JWKS from %s: %s', self.url, error)
+                self._expires_at = now + self.min_refresh_interval
+            else:
+                self.keys = keys
+                self._expires_at = now + max(max_age, self.min_refresh_interval)
+            finally:
+                self._generation += 1
+
+    def refresh_in_background(self, generation=None):
+        with self._background_lock:
+            if self.background is None or not self.background.is_alive():
+                self.background = threading.Thread(
+                    target=self.refresh, args=(generation,), daemon=True)
+                self.background.start()
+            return self.background
+
+    def prefetch(self):
+        return self.refresh_in_background()
+
+    def get_key(self, kid):
+        generation = self._generation
+        if time.monotonic() >= self._expires_at:
+            if self.keys:
+                # stale-while-revalidate, the request goes on with the old keys
+                self.refresh_in_background(generation)
+            else:
+                self.refresh(generation)
+                generation = self._generation
+        key = self.keys.get(kid)
+        if key is None and (
+                self._last_attempt is None or
+                time.monotonic() - self._last_attempt >= self.min_refresh_interval):
+            # the key set may have been rotated since the last fetch
+            self.refresh(generation)
+            key = self.keys.get(kid)
+        return key
+
+
+jwks_store = JWKSStore()
+
 '''
 Verify and decode jwt
 '''
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -118,6 +239,78 @@ def verify_decode_jwt(token):
                 'description': 'Unable to find the appropriate key.'
             }, 401)
 
+'''
+Verified token cache
+    LRU of decoded payloads keyed by the sha256 digest of the token
+    an entry is dropped once the token's exp has passed, so a cached
+    payload is never served for an expired token
+'''
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                payload, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return payload
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def set(self, token, payload):
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)) or self.maxsize <= 0:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (payload, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def samples(self):
+        return [
+            ('madb_token_cache_hits_total', 'counter',
+             'Bearer tokens found in the verified token cache.',
+             [({}, self.hits)]),
+            ('madb_token_cache_misses_total', 'counter',
+             'Bearer tokens that had to be verified.',
+             [({}, self.misses)]),
+            ('madb_token_cache_entries', 'gauge',
+             'Tokens in the verified token cache.',
+             [({}, len(self._entries))])
+        ]
+
+
+token_cache = TokenCache()
+metrics.collectors.append(token_cache.samples)
+
 '''
 auth decorator
 '''
@@ -125,9 +318,13 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.set(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,91 @@
+from flask import abort, current_app, request
+
+ACTOR_FIELDS = {'name': str, 'gender': str, 'age': int}
+MOVIE_FIELDS = {'title': str, 'year': int}
+
+'''
+check_batch_size(size)
+    rejects empty batches with 400 and batches above MAX_BATCH_SIZE
+    with 413
+'''
+def check_batch_size(size):
+    if size == 0:
+        abort(400)
+    if size > current_app.config['MAX_BATCH_SIZE']:
+        abort(413)
+
+'''
+_valid(value, kind)
+    type check of a single field, bools are not accepted as ints
+'''
+def _valid(value, kind):
+    if kind is int and isinstance(value, bool):
+        return False
+    return isinstance(value, kind)
+
+'''
+get_batch(fields)
+    validates the whole JSON array in the request body up front and
+    returns it as a list of column dicts
+    every item must be an object holding every field with the right type
+'''
+def get_batch(fields):
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(400)
+    check_batch_size(len(items))
+
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            abort(400)
+        if not all(_valid(item.get(field), kind)
+                   for field, kind in fields.items()):
+            abort(400)
+        rows.append({field: item[field] for field in fields})
+
+    return rows
+
+'''
+get_batch_updates(fields)
+    validates a JSON array of partial updates up front and returns it
+    as a list of column dicts
+    every item must be an object with an integer id, at most once in the
+    batch, and any of fields with the right type
+'''
+def get_batch_updates(fields):
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(400)
+    check_batch_size(len(items))
+
+    ids = set()
+    for item in items:
+        if not isinstance(item, dict) or not _valid(item.get('id'), int):
+            abort(400)
+        if item['id'] in ids:
+            abort(400)
+        ids.add(item['id'])
+        if not all(field in fields and _valid(value, fields[field])
+                   for field, value in item.items() if field != 'id'):
+            abort(400)
+
+    return items
+
+'''
+get_batch_ids()
+    ?ids=<id>,<id> as a list of distinct integer ids, 400 when missing
+    or malformed
+'''
+def get_batch_ids():
+    ids = request.args.get('ids')
+    if ids is None:
+        abort(400)
+
+    try:
+        ids = list(dict.fromkeys(int(row_id) for row_id in ids.split(',')))
+    except ValueError:
+        abort(400)
+    check_batch_size(len(ids))
+
+    return ids
@@ -0,0 +1,140 @@
+'''
+SQLite read/write concurrency under several worker processes
+
+Every worker is a separate process with its own app and engine, like a
+gunicorn worker. Workers loop over a mix of single-row inserts (one
+commit each, as Actor.insert() does) and page reads, and the benchmark
+reports throughput, read latency and the number of "database is locked"
+failures for the legacy settings and the default engine profile.
+
+    python benchmarks/engine_profiles.py --workers 4 --duration 10
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+from models import db, setup_db, Actor, DEFAULT_ENGINE_PROFILE, LEGACY_ENGINE_PROFILE
+
+PROFILES = {
+    'legacy': LEGACY_ENGINE_PROFILE,
+    'default': DEFAULT_ENGINE_PROFILE
+}
+
+
+def make_app(path, profile):
+    app = Flask(__name__)
+    setup_db(app, 'sqlite:///{}'.format(path), profile)
+    return app
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def worker(path, profile, duration, write_ratio, seed, results):
+    app = make_app(path, profile)
+    reads, writes, locked = 0, 0, 0
+    read_latencies = []
+    with app.app_context():
+        deadline = time.monotonic() + duration
+        counter = seed
+        while time.monotonic() < deadline:
+            counter += 1
+            try:
+                if counter % 100 < write_ratio * 100:
+                    Actor(name='Actor {}'.format(counter), gender='Female',
+                          age=counter % 90).insert()
+                    writes += 1
+                else:
+                    start = time.perf_counter()
+                    Actor.query.order_by(Actor.id.desc()).limit(50).all()
+                    read_latencies.append(time.perf_counter() - start)
+                    reads += 1
+            except OperationalError:
+                db.session.rollback()
+                locked += 1
+    results.put({
+        'reads': reads,
+        'writes': writes,
+        'locked': locked,
+        'read_latencies': read_latencies
+    })
+
+
+def run(name, workers, duration, write_ratio, rows):
+    profile = PROFILES[name]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = make_app(path, profile)
+        with app.app_context():
+            db.create_all()
+            db.session.bulk_insert_mappings(Actor, [
+                {'name': 'Seed {}'.format(i), 'gender': 'Male', 'age': i % 90}
+                for i in range(rows)])
+            db.session.commit()
+            db.session.remove()
+            db.get_engine(app).dispose()
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(
+            target=worker,
+            args=(path, profile, duration, write_ratio, i * 1000000, results))
+            for i in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    latencies = [l for total in totals for l in total['read_latencies']]
+    reads = sum(total['reads'] for total in totals)
+    writes = sum(total['writes'] for total in totals)
+    return {
+        'profile': name,
+        'workers': workers,
+        'duration': duration,
+        'reads_per_second': reads / duration,
+        'writes_per_second': writes / duration,
+        'locked_errors': sum(total['locked'] for total in totals),
+        'read_p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'read_p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = [run(name, args.workers, args.duration, args.write_ratio, args.rows)
+               for name in args.profile or ['legacy', 'default']]
+
+    print('{:<8} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'profile', 'reads/s', 'writes/s', 'locked', 'p50 ms', 'p99 ms'))
+    for result in results:
+        print('{profile:<8} {reads_per_second:>10.0f} {writes_per_second:>10.0f} '
+              '{locked_errors:>8} {read_p50_ms:>10.2f} {read_p99_ms:>10.2f}'.format(**result))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
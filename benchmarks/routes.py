@@ -0,0 +1,336 @@
+'''
+Offline benchmark of every route of the API
+
+Tokens are signed with a local RSA key and verified by the real auth
+code against a stub JWKS server, the catalog is seeded in a temporary
+SQLite database at the requested size, and the app is served by a
+threaded werkzeug server in its own process. Every route is then driven
+at a fixed concurrency and p50/p95/p99 latency and throughput are
+reported and saved as JSON so releases can be compared.
+
+    python benchmarks/routes.py --rows 10000 --concurrency 8 --requests 500 \\
+        --json results.json
+'''
+import argparse
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_auth import JWKSServer, LocalSigner
+
+
+'''
+seed(database_uri, rows, cast_per_movie)
+    rows actors and rows movies, each movie cast with cast_per_movie
+    actors, inserted with bulk inserts in chunks
+'''
+def seed(database_uri, rows, cast_per_movie, chunk=10000):
+    from flask import Flask
+    from models import db, setup_db, bump_table_version, rebuild_stats, Actor, Movie, Casting
+    import search  # registers the full-text DDL on create_all
+
+    app = Flask(__name__)
+    setup_db(app, database_uri)
+    genders = ['Female', 'Male', 'Non-binary']
+    words = ['Star', 'Night', 'River', 'Storm', 'Garden', 'Empire', 'Ghost', 'Summer']
+    with app.app_context():
+        db.create_all()
+        for start in range(1, rows + 1, chunk):
+            ids = range(start, min(start + chunk, rows + 1))
+            db.session.bulk_insert_mappings(Actor, [{
+                'id': i,
+                'name': 'Actor {} {}'.format(words[i % len(words)], i),
+                'gender': genders[i % len(genders)],
+                'age': 18 + i % 70
+            } for i in ids])
+            db.session.bulk_insert_mappings(Movie, [{
+                'id': i,
+                'title': '{} of the {} {}'.format(
+                    words[i % len(words)], words[(i // 8) % len(words)], i),
+                'year': 1920 + i % 100
+            } for i in ids])
+            db.session.bulk_insert_mappings(Casting, [{
+                'movie_id': i,
+                'actor_id': (i + offset - 1) % rows + 1,
+                'role': 'Role {}'.format(offset)
+            } for i in ids for offset in range(min(cast_per_movie, rows))])
+            db.session.commit()
+        for table in ('actors', 'movies', 'castings'):
+            bump_table_version(table)
+        db.session.commit()
+        # bulk_insert_mappings bypasses the write paths that keep it current
+        rebuild_stats()
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+
+'''
+serve(database_uri, jwks_url, port)
+    runs the app on a threaded werkzeug server, in a child process
+'''
+def serve(database_uri, jwks_url, port, ready):
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri, 'JWKS_URL': jwks_url})
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+'''
+routes(rows, rng)
+    one entry per route: the role of the caller, the request built for
+    the i-th call and how many calls it gets relative to --requests
+    writes use distinct ids per call so every call does real work
+'''
+def routes(rows, rng):
+    def any_id(i):
+        return rng.randint(1, rows)
+
+    def batch(kind, i):
+        if kind == 'actors':
+            return [{'name': 'Batch {}-{}'.format(i, n), 'gender': 'Female',
+                     'age': 30} for n in range(100)]
+        return [{'title': 'Batch {}-{}'.format(i, n), 'year': 2000}
+                for n in range(100)]
+
+    def block(i, start):
+        # 100 distinct ids per call, counting down from start
+        return [(start - 1 - i * 100 - n) % rows + 1 for n in range(min(100, rows))]
+
+    def ids(i, start):
+        return ','.join(str(row_id) for row_id in block(i, start))
+
+    return [
+        ('home', None, lambda i: ('GET', '/', None), 1),
+        ('get_actors', 'casting_assistant',
+         lambda i: ('GET', '/actors?limit=100', None), 1),
+        ('get_actors_filtered', 'casting_assistant',
+         lambda i: ('GET', '/actors?gender=Female&min_age=20&max_age=40'
+                           '&sort=-age&limit=100', None), 1),
+        ('get_actors_include_cast', 'casting_assistant',
+         lambda i: ('GET', '/actors?include=cast&limit=100', None), 1),
+        ('get_actors_stream', 'casting_assistant',
+         lambda i: ('GET', '/actors?stream=1', None), 0.02),
+        ('head_actors', 'casting_assistant',
+         lambda i: ('HEAD', '/actors', None), 1),
+        ('get_actor', 'casting_assistant',
+         lambda i: ('GET', '/actors/{}'.format(any_id(i)), None), 1),
+        ('get_actor_movies', 'casting_assistant',
+         lambda i: ('GET', '/actors/{}/movies'.format(any_id(i)), None), 1),
+        ('get_movies', 'casting_assistant',
+         lambda i: ('GET', '/movies?limit=100', None), 1),
+        ('get_movies_filtered', 'casting_assistant',
+         lambda i: ('GET', '/movies?year_from=1990&year_to=2010'
+                           '&sort=year&limit=100', None), 1),
+        ('get_movies_include_cast', 'casting_assistant',
+         lambda i: ('GET', '/movies?include=cast&limit=100', None), 1),
+        ('get_movies_stream', 'casting_assistant',
+         lambda i: ('GET', '/movies?stream=1', None), 0.02),
+        ('head_movies', 'casting_assistant',
+         lambda i: ('HEAD', '/movies', None), 1),
+        ('get_movie', 'casting_assistant',
+         lambda i: ('GET', '/movies/{}'.format(any_id(i)), None), 1),
+        ('get_movie_cast', 'casting_assistant',
+         lambda i: ('GET', '/movies/{}/cast'.format(any_id(i)), None), 1),
+        ('search', 'casting_assistant',
+         lambda i: ('GET', '/search?q=storm+garden&limit=20', None), 1),
+        ('stats', 'casting_assistant', lambda i: ('GET', '/stats', None), 1),
+        ('cache_stats', None, lambda i: ('GET', '/cache/stats', None), 1),
+        ('metrics', None, lambda i: ('GET', '/metrics', None), 1),
+        ('add_actor', 'casting_director',
+         lambda i: ('POST', '/actors', {'name': 'New {}'.format(i),
+                                        'gender': 'Male', 'age': 40}), 1),
+        ('add_actors_batch', 'casting_director',
+         lambda i: ('POST', '/actors/batch', batch('actors', i)), 0.1),
+        ('update_actors_batch', 'casting_director',
+         lambda i: ('PATCH', '/actors', [{'id': row_id, 'age': 34}
+                                         for row_id in block(i, rows)]), 0.1),
+        ('update_actor', 'casting_director',
+         lambda i: ('PATCH', '/actors/{}'.format(any_id(i)),
+                    {'name': 'Renamed {}'.format(i), 'gender': 'Female',
+                     'age': 33}), 1),
+        ('add_movie', 'executive_producer',
+         lambda i: ('POST', '/movies', {'title': 'New {}'.format(i),
+                                        'year': 2021}), 1),
+        ('add_movies_batch', 'executive_producer',
+         lambda i: ('POST', '/movies/batch', batch('movies', i)), 0.1),
+        ('update_movies_batch', 'casting_director',
+         lambda i: ('PATCH', '/movies', [{'id': row_id, 'year': 2001}
+                                         for row_id in block(i, rows)]), 0.1),
+        ('update_movie', 'casting_director',
+         lambda i: ('PATCH', '/movies/{}'.format(any_id(i)),
+                    {'title': 'Retitled {}'.format(i), 'year': 1999}), 1),
+        ('add_casting', 'casting_director',
+         lambda i: ('POST', '/movies/{}/cast'.format(i % rows + 1),
+                    {'actor_id': (i % rows + rows // 2) % rows + 1,
+                     'role': 'Extra'}), 1),
+        ('delete_casting', 'casting_director',
+         lambda i: ('DELETE', '/movies/{0}/cast/{0}'.format(i % rows + 1),
+                    None), 1),
+        ('delete_actor', 'casting_director',
+         lambda i: ('DELETE', '/actors/{}'.format(rows - i % rows), None), 1),
+        ('delete_movie', 'executive_producer',
+         lambda i: ('DELETE', '/movies/{}'.format(rows - i % rows), None), 1),
+        ('delete_actors_batch', 'casting_director',
+         lambda i: ('DELETE', '/actors?ids=' + ids(i, rows // 2), None), 0.1),
+        ('delete_movies_batch', 'executive_producer',
+         lambda i: ('DELETE', '/movies?ids=' + ids(i, rows // 2), None), 0.1),
+    ]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+'''
+drive(port, make_request, headers, total, concurrency)
+    sends total requests from concurrency keep-alive connections and
+    returns the latency of every request with the status codes seen
+'''
+def drive(port, make_request, headers, total, concurrency):
+    counter = itertools.count()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        while True:
+            i = next(counter)
+            if i >= total:
+                break
+            method, path, body = make_request(i)
+            request_headers = dict(headers)
+            if body is not None:
+                body = json.dumps(body)
+                request_headers['Content-Type'] = 'application/json'
+            start = time.perf_counter()
+            connection.request(method, path, body=body, headers=request_headers)
+            response = connection.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='actors and movies to seed (1k to 1M)')
+    parser.add_argument('--cast-per-movie', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per route, scaled down for heavy routes')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--route', action='append',
+                        help='only run these routes (repeatable)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    signer = LocalSigner()
+    jwks_server = JWKSServer(signer).start()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = 'sqlite:///{}'.format(os.path.join(directory, 'bench.db'))
+        start = time.perf_counter()
+        seed(database_uri, args.rows, args.cast_per_movie)
+        print('seeded {} rows in {:.1f}s'.format(args.rows, time.perf_counter() - start))
+
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(
+            target=serve, args=(database_uri, jwks_server.url, args.port, ready),
+            daemon=True)
+        server.start()
+        ready.wait(60)
+
+        results = []
+        try:
+            print('{:<26} {:>7} {:>9} {:>9} {:>9} {:>9}  {}'.format(
+                'route', 'req', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'))
+            for name, role, make_request, weight in routes(args.rows, rng):
+                if args.route and name not in args.route:
+                    continue
+                headers = {}
+                if role is not None:
+                    headers['Authorization'] = 'Bearer ' + signer.role_token(role)
+                total = max(1, int(args.requests * weight))
+                warmup = min(args.warmup, total)
+                drive(args.port, make_request, headers, warmup, 1)
+                latencies, statuses, elapsed = drive(
+                    args.port, lambda i: make_request(i + warmup), headers,
+                    total, args.concurrency)
+                latencies.sort()
+                result = {
+                    'route': name,
+                    'requests': total,
+                    'concurrency': args.concurrency,
+                    'throughput': total / elapsed,
+                    'p50_ms': percentile(latencies, 0.50) * 1000,
+                    'p95_ms': percentile(latencies, 0.95) * 1000,
+                    'p99_ms': percentile(latencies, 0.99) * 1000,
+                    'statuses': {str(status): count
+                                 for status, count in sorted(statuses.items())}
+                }
+                results.append(result)
+                print('{route:<26} {requests:>7} {throughput:>9.1f} {p50_ms:>9.2f} '
+                      '{p95_ms:>9.2f} {p99_ms:>9.2f}  {statuses}'.format(**result))
+        finally:
+            server.terminate()
+            server.join()
+            jwks_server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'rows': args.rows,
+                'cast_per_movie': args.cast_per_movie,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'seed': args.seed,
+                'results': results
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, g, request
+from metrics import metrics
+from models import table_write_listeners
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# headers set by views that are kept with a cached body
+CACHED_HEADERS = ('X-Total-Count',)
+
+'''
+LRUBackend
+    in-process cache bounded by entry count and total body size
+    entries are tagged with the tables they were read from so a write
+    to a table drops exactly the entries built from it
+'''
+class LRUBackend:
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, tags, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, tags, ttl):
+        if len(value['body']) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tags, time.monotonic() + ttl)
+            self.size += len(value['body'])
+            while len(self._entries) > self.max_entries or \
+                    self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tag):
+        with self._lock:
+            keys = [key for key, (_, tags, _) in self._entries.items()
+                    if tag in tags]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def _remove(self, key):
+        value, _, _ = self._entries.pop(key)
+        self.size -= len(value['body'])
+
+    def stats(self):
+        return {
+            'backend': 'lru',
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+'''
+RedisBackend
+    cache shared by every worker, needs the optional redis package
+    each table has a set of the keys built from it for invalidation,
+    size is bounded by the maxmemory policy of the redis server
+'''
+class RedisBackend:
+    prefix = 'madb:cache:'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE=redis needs the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self.prefix + key)
+        except redis.RedisError:
+            logger.exception('Response cache read failed')
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, tags, ttl):
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(self.prefix + key, json.dumps(value), ex=ttl)
+            for tag in tags:
+                pipe.sadd(self.prefix + 'tag:' + tag, self.prefix + key)
+            pipe.execute()
+        except redis.RedisError:
+            logger.exception('Response cache write failed')
+
+    def invalidate(self, tag):
+        tag_key = self.prefix + 'tag:' + tag
+        try:
+            keys = self.client.smembers(tag_key)
+            self.client.delete(tag_key, *keys)
+            self.invalidations += len(keys)
+        except redis.RedisError:
+            logger.exception('Response cache invalidation failed')
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+'''
+ResponseCache
+    read-through cache of GET responses
+    keys are the ETag computed by the conditional decorator, which covers
+    the route, query string, Accept header and the versions of every
+    table read, plus the permission scope of the caller
+'''
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.ttl = 0
+
+    def init_app(self, app):
+        kind = app.config['RESPONSE_CACHE']
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        if kind == 'lru':
+            self.backend = LRUBackend(
+                app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                app.config['RESPONSE_CACHE_MAX_BYTES'])
+        elif kind == 'redis':
+            self.backend = RedisBackend(app.config['RESPONSE_CACHE_REDIS_URL'])
+        else:
+            self.backend = None
+
+    def invalidate(self, table):
+        if self.backend is not None:
+            self.backend.invalidate(table)
+
+    def stats(self):
+        if self.backend is None:
+            return {'backend': None}
+        return self.backend.stats()
+
+    def samples(self):
+        stats = self.stats()
+        if stats['backend'] is None:
+            return []
+        labels = {'backend': stats['backend']}
+        samples = [
+            ('madb_response_cache_{}_total'.format(counter), 'counter',
+             'Response cache {}.'.format(counter), [(labels, stats[counter])])
+            for counter in ('hits', 'misses', 'evictions', 'invalidations')
+            if counter in stats]
+        if 'entries' in stats:
+            samples.append(('madb_response_cache_entries', 'gauge',
+                            'Responses in the cache.', [(labels, stats['entries'])]))
+            samples.append(('madb_response_cache_bytes', 'gauge',
+                            'Size of the cached response bodies.', [(labels, stats['bytes'])]))
+        return samples
+
+    @staticmethod
+    def key(payload):
+        scope = ' '.join(sorted(payload.get('permissions', [])))
+        return '{}:{}'.format(g.etag, scope)
+
+    def cached(self, f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            # the ETag doesn't cover the method: HEAD neither reads GET
+            # entries nor stores its bodiless responses
+            if self.backend is None or 'etag' not in g or request.method == 'HEAD':
+                return f(payload, *args, **kwargs)
+
+            key = self.key(payload)
+            value = self.backend.get(key)
+            if value is not None:
+                return Response(value['body'], status=value['status'],
+                                headers=value.get('headers'),
+                                mimetype=value['mimetype'])
+
+            response = f(payload, *args, **kwargs)
+            if isinstance(response, tuple):
+                body, status = response
+            else:
+                body, status = response, 200
+            if status == 200 and not body.is_streamed:
+                self.backend.set(key, {
+                    'status': status,
+                    'mimetype': body.mimetype,
+                    'headers': [(name, value) for name, value in body.headers
+                                if name in CACHED_HEADERS],
+                    'body': body.get_data(as_text=True)
+                }, g.etag_tables, self.ttl)
+            return response
+
+        return wrapper
+
+
+response_cache = ResponseCache()
+table_write_listeners.append(response_cache.invalidate)
+metrics.collectors.append(response_cache.samples)
+cached = response_cache.cached
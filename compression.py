@@ -0,0 +1,151 @@
+import threading
+import time
+import zlib
+from flask import request
+from metrics import add_timing, metrics
+from streaming import NDJSON_MIMETYPE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', NDJSON_MIMETYPE, 'text/html', 'text/plain')
+
+'''
+_gzip(level) / _brotli(level)
+    (compress, finish) pair of a new compressor: compress(data) returns
+    everything data can be encoded into so far, so each chunk of a
+    streamed response goes out as soon as it is produced, finish()
+    returns the end of the stream
+'''
+def _gzip(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush)
+
+def _brotli(level):
+    compressor = brotli.Compressor(quality=level)
+    return (lambda data: compressor.process(data) + compressor.flush(),
+            compressor.finish)
+
+'''
+CompressionStats
+    responses, bytes in and out and CPU time spent per encoding in this
+    process, exported on /metrics
+'''
+class CompressionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.encodings = {}
+
+    def record(self, encoding, size_in, size_out, seconds):
+        with self._lock:
+            stats = self.encodings.setdefault(encoding, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += size_in
+            stats[2] += size_out
+            stats[3] += seconds
+
+    def samples(self):
+        with self._lock:
+            encodings = sorted((encoding, list(stats))
+                               for encoding, stats in self.encodings.items())
+        samples = [
+            (name, kind, description,
+             [({'encoding': encoding}, stats[i]) for encoding, stats in encodings])
+            for i, (name, kind, description) in enumerate([
+                ('madb_compressed_responses_total', 'counter', 'Compressed responses.'),
+                ('madb_compression_input_bytes_total', 'counter', 'Response bytes before compression.'),
+                ('madb_compression_output_bytes_total', 'counter', 'Response bytes after compression.'),
+                ('madb_compression_cpu_seconds_total', 'counter', 'CPU time spent compressing.')])]
+        samples.append(('madb_compression_ratio', 'gauge',
+                        'Compressed size over original size of all responses.',
+                        [({'encoding': encoding}, stats[2] / stats[1])
+                         for encoding, stats in encodings if stats[1]]))
+        return samples
+
+
+compression_stats = CompressionStats()
+metrics.collectors.append(compression_stats.samples)
+
+'''
+_compress_stream(chunks, encoder, encoding)
+    compresses a streamed response chunk by chunk as it is sent
+'''
+def _compress_stream(chunks, encoder, encoding):
+    compress, finish = encoder
+    size_in = size_out = seconds = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            start = time.thread_time()
+            data = compress(chunk)
+            seconds += time.thread_time() - start
+            size_in += len(chunk)
+            size_out += len(data)
+            if data:
+                yield data
+        data = finish()
+        size_out += len(data)
+        yield data
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        compression_stats.record(encoding, size_in, size_out, seconds)
+
+'''
+init_compression(app)
+    compresses responses of app with the encoding the client prefers in
+    Accept-Encoding, brotli (when the brotli package is installed) or
+    gzip
+    - COMPRESSION_MIN_SIZE: smaller bodies are sent as they are, the
+      gain doesn't pay for the CPU time
+    - COMPRESSION_LEVEL / COMPRESSION_BROTLI_LEVEL: gzip level (1-9) and
+      brotli quality (0-11)
+    streamed responses are always compressed, one chunk at a time
+    must run after init_metrics, so compression time is counted in the
+    request it belongs to
+'''
+def init_compression(app):
+    encoders = {'gzip': lambda: _gzip(app.config['COMPRESSION_LEVEL'])}
+    if brotli is not None:
+        encoders['br'] = lambda: _brotli(app.config['COMPRESSION_BROTLI_LEVEL'])
+    # preferred first when the client accepts both equally
+    preference = sorted(encoders, key=lambda encoding: encoding != 'br')
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers):
+            return response
+
+        encoding = request.accept_encodings.best_match(preference)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoders[encoding](), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+                return response
+            compress, finish = encoders[encoding]()
+            start = time.thread_time()
+            compressed = compress(data) + finish()
+            seconds = time.thread_time() - start
+            add_timing('compress', seconds)
+            compression_stats.record(encoding, len(data), len(compressed), seconds)
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,48 @@
+import hashlib
+from functools import wraps
+from flask import g, make_response, request
+from models import get_table_versions
+
+'''
+table_etag(tables)
+    weak ETag of a GET reading tables: changes whenever one of the table
+    versions is bumped, and differs per URL and Accept header since
+    those select different representations
+'''
+def table_etag(tables):
+    versions = ','.join(
+        '{}={}'.format(table, version)
+        for table, version in sorted(get_table_versions(tables).items()))
+    raw = '{}:{}:{}'.format(
+        versions,
+        request.full_path,
+        request.headers.get('Accept', ''))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+'''
+conditional decorator
+    answers If-None-Match with 304 Not Modified straight from the table
+    version, before the view queries or serializes anything
+    must be applied below requires_auth so unauthorized clients never
+    get a 304
+    included maps an ?include= value to the extra tables it reads
+    the ETag and the tables are left in g for the response cache
+'''
+def conditional(*tables, **included):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.etag_tables = tables + included.get(request.args.get('include'), ())
+            g.etag = etag = table_etag(g.etag_tables)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+
+        return wrapper
+    return conditional_decorator
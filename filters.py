@@ -0,0 +1,133 @@
+from flask import abort, request
+from sqlalchemy.orm import load_only
+from models import Actor, Movie
+
+ACTOR_SORTS = {'id': Actor.id, 'name': Actor.name, 'age': Actor.age}
+MOVIE_SORTS = {'id': Movie.id, 'title': Movie.title, 'year': Movie.year}
+ACTOR_COLUMNS = {'id': Actor.id, 'name': Actor.name, 'gender': Actor.gender, 'age': Actor.age}
+MOVIE_COLUMNS = {'id': Movie.id, 'title': Movie.title, 'year': Movie.year}
+
+'''
+get_int_arg(name)
+    integer query string argument, None when missing, 400 when malformed
+'''
+def get_int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+'''
+get_sort(sorts)
+    ?sort=<field> or ?sort=-<field> for descending order
+    returns a (column, descending) pair, None when not given, 400 for a
+    field that is not sortable
+'''
+def get_sort(sorts):
+    sort = request.args.get('sort')
+    if sort is None:
+        return None
+
+    descending = sort.startswith('-')
+    column = sorts.get(sort.lstrip('-'))
+    if column is None:
+        abort(400)
+
+    return column, descending
+
+'''
+include_cast()
+    True with ?include=cast, 400 for anything else that can't be included
+'''
+def include_cast():
+    include = request.args.get('include')
+    if include is None:
+        return False
+    if include != 'cast':
+        abort(400)
+
+    return True
+
+'''
+get_fields(columns)
+    ?fields=<field>,<field> as a list of requested fields in order, None
+    when not given, 400 for an empty list or a field that doesn't exist
+'''
+def get_fields(columns):
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+
+    fields = [field.strip() for field in fields.split(',')]
+    if not all(field in columns for field in fields):
+        abort(400)
+
+    return list(dict.fromkeys(fields))
+
+'''
+select_fields(query, columns, fields, sort=None)
+    loads only the requested columns (and the sort column, which the
+    next page cursor is built from), the primary key is always loaded
+'''
+def select_fields(query, columns, fields, sort=None):
+    loaded = [columns[field].key for field in fields]
+    if sort is not None and sort[0].key not in loaded:
+        loaded.append(sort[0].key)
+
+    return query.options(load_only(*loaded))
+
+'''
+formatter(fields=None, cast=False)
+    function formatting a row as format() would, narrowed to the
+    requested fields, with its cast when included
+'''
+def formatter(fields=None, cast=False):
+    def format_row(row):
+        if fields is None:
+            formatted = row.format()
+        else:
+            formatted = {field: getattr(row, field) for field in fields}
+        if cast:
+            formatted['cast'] = row.format_cast()
+        return formatted
+
+    return format_row
+
+'''
+filter_actors(query)
+    ?gender=, ?min_age= and ?max_age= as SQL WHERE clauses
+    served by the ix_actors_gender_age and ix_actors_age indexes
+'''
+def filter_actors(query):
+    gender = request.args.get('gender')
+    min_age = get_int_arg('min_age')
+    max_age = get_int_arg('max_age')
+
+    if gender is not None:
+        query = query.filter(Actor.gender == gender)
+    if min_age is not None:
+        query = query.filter(Actor.age >= min_age)
+    if max_age is not None:
+        query = query.filter(Actor.age <= max_age)
+
+    return query
+
+'''
+filter_movies(query)
+    ?year_from= and ?year_to= as SQL WHERE clauses
+    served by the ix_movies_year index
+'''
+def filter_movies(query):
+    year_from = get_int_arg('year_from')
+    year_to = get_int_arg('year_to')
+
+    if year_from is not None:
+        query = query.filter(Movie.year >= year_from)
+    if year_to is not None:
+        query = query.filter(Movie.year <= year_to)
+
+    return query
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import rsa
+from jose import jwk, jwt
+from auth import ALGORITHMS, API_AUDIENCE, AUTH0_DOMAIN
+
+'''
+Local auth
+    signs access tokens with a locally generated RSA key and serves the
+    matching JWKS from a stub HTTP server, so the API can be exercised
+    offline by benchmarks and tests, with the real verify_decode_jwt
+'''
+
+# permissions of the Auth0 roles described in the README
+ROLES = {
+    'casting_assistant': ['get:actors', 'get:movies'],
+    'casting_director': ['get:actors', 'get:movies', 'post:actors',
+                         'delete:actors', 'patch:actors', 'patch:movies'],
+    'executive_producer': ['get:actors', 'get:movies', 'post:actors',
+                           'delete:actors', 'patch:actors', 'patch:movies',
+                           'post:movies', 'delete:movies']
+}
+
+
+'''
+LocalSigner
+    RSA key pair with its JWKS, signs tokens with the issuer and audience
+    verify_decode_jwt expects
+'''
+class LocalSigner:
+    def __init__(self, kid='local-key', bits=2048):
+        self.kid = kid
+        _, private_key = rsa.newkeys(bits)
+        self.private_key = private_key.save_pkcs1().decode()
+        public_key = jwk.construct(self.private_key, ALGORITHMS[0]).public_key()
+        key = {name: value.decode() if isinstance(value, bytes) else value
+               for name, value in public_key.to_dict().items()}
+        self.jwks = {'keys': [dict(key, kid=kid, use='sig')]}
+
+    def token(self, permissions, expires_in=3600, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://' + AUTH0_DOMAIN + '/',
+            'sub': 'local|benchmark',
+            'aud': API_AUDIENCE,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': permissions
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_key,
+                          algorithm=ALGORITHMS[0], headers={'kid': self.kid})
+
+    def role_token(self, role, **claims):
+        return self.token(ROLES[role], **claims)
+
+
+'''
+JWKSServer
+    serves the JWKS of a LocalSigner on 127.0.0.1 from a daemon thread
+'''
+class JWKSServer(HTTPServer):
+    def __init__(self, signer, port=0):
+        body = json.dumps(signer.jwks).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+            self.server_port)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
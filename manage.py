@@ -1,5 +1,7 @@
+import sys
 from app import app
-from models import db
+from models import db, rebuild_stats as rebuild_catalog_stats
+from transfer import FORMATS, TABLES, export_file, import_file
 
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
@@ -11,5 +13,42 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('--restart', dest='restart', action='store_true',
+                help='start over instead of resuming an interrupted import')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=10000,
+                help='records inserted and committed at a time')
+@manager.option('-f', '--format', dest='fmt', choices=FORMATS,
+                help='file format, guessed from the extension by default')
+@manager.option('path')
+@manager.option('table', choices=sorted(TABLES))
+def import_data(table, path, fmt=None, chunk_size=10000, restart=False):
+    """Import actors or movies from a CSV or NDJSON file"""
+    try:
+        import_file(table, path, fmt, chunk_size, restart)
+    except ValueError as e:
+        sys.exit('Import stopped: {} (rerun to resume after the last committed chunk)'.format(e))
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=10000,
+                help='rows fetched from the database at a time')
+@manager.option('-f', '--format', dest='fmt', choices=FORMATS,
+                help='file format, guessed from the extension by default')
+@manager.option('path', help="file to write, '-' for stdout")
+@manager.option('table', choices=sorted(TABLES))
+def export_data(table, path, fmt=None, chunk_size=10000):
+    """Export actors or movies to a CSV or NDJSON file"""
+    try:
+        export_file(table, path, fmt, chunk_size)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+@manager.command
+def rebuild_stats():
+    """Recompute catalog_stats, the counts behind /stats, from the tables"""
+    rebuild_catalog_stats()
+    print('catalog_stats rebuilt')
+
+
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
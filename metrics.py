@@ -0,0 +1,196 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+
+PHASES = ('auth', 'db', 'serialize')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+'''
+add_timing(phase, seconds) / timed(phase)
+    add time spent in a phase to the breakdown of the current request,
+    no-ops outside of a request
+'''
+def add_timing(phase, seconds):
+    if has_request_context() and 'timings' in g:
+        g.timings[phase] = g.timings.get(phase, 0) + seconds
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - start)
+
+'''
+Histogram
+    cumulative bucket counts, sum and count of observations
+'''
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+'''
+Metrics
+    per-route request counters, latency histograms and time per phase
+    of this process, rendered in the Prometheus text format
+    collectors are callables returning extra samples as
+    (name, type, help, [(labels, value), ...]) tuples
+'''
+class Metrics:
+    def __init__(self):
+        self.collectors = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.durations = {}
+            self.phases = {}
+            self.queries = {}
+
+    def observe(self, route, method, status, duration, timings, queries):
+        with self._lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.queries[route, method] = self.queries.get((route, method), 0) + queries
+            histogram = self.durations.get((route, method))
+            if histogram is None:
+                histogram = self.durations[route, method] = Histogram()
+            histogram.observe(duration)
+            for phase, seconds in timings.items():
+                key = (route, method, phase)
+                self.phases[key] = self.phases.get(key, 0) + seconds
+
+    @staticmethod
+    def _labels(**labels):
+        return '{' + ','.join(
+            '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                             .replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in labels.items()) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP madb_requests_total Requests handled, by route, method and status.')
+            lines.append('# TYPE madb_requests_total counter')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('madb_requests_total{} {}'.format(
+                    self._labels(route=route, method=method, status=status), count))
+
+            lines.append('# HELP madb_request_duration_seconds Request latency, by route and method.')
+            lines.append('# TYPE madb_request_duration_seconds histogram')
+            for (route, method), histogram in sorted(self.durations.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('madb_request_duration_seconds_bucket{} {}'.format(
+                        self._labels(route=route, method=method, le=bound), count))
+                lines.append('madb_request_duration_seconds_bucket{} {}'.format(
+                    self._labels(route=route, method=method, le='+Inf'), histogram.count))
+                lines.append('madb_request_duration_seconds_sum{} {}'.format(
+                    self._labels(route=route, method=method), histogram.sum))
+                lines.append('madb_request_duration_seconds_count{} {}'.format(
+                    self._labels(route=route, method=method), histogram.count))
+
+            lines.append('# HELP madb_request_phase_seconds_total Time spent per request phase, by route and method.')
+            lines.append('# TYPE madb_request_phase_seconds_total counter')
+            for (route, method, phase), seconds in sorted(self.phases.items()):
+                lines.append('madb_request_phase_seconds_total{} {}'.format(
+                    self._labels(route=route, method=method, phase=phase), seconds))
+
+            lines.append('# HELP madb_sql_statements_total SQL statements executed, by route and method.')
+            lines.append('# TYPE madb_sql_statements_total counter')
+            for (route, method), count in sorted(self.queries.items()):
+                lines.append('madb_sql_statements_total{} {}'.format(
+                    self._labels(route=route, method=method), count))
+
+        for collector in self.collectors:
+            for name, kind, description, samples in collector():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in samples:
+                    lines.append('{}{} {}'.format(
+                        name, self._labels(**labels) if labels else '', value))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+'''
+count_query(seconds)
+    records one SQL statement in the current request
+'''
+def count_query(seconds):
+    if has_request_context() and 'timings' in g:
+        g.timings['db'] += seconds
+        g.query_count += 1
+
+'''
+QueryBudgetExceeded
+    raised when QUERY_BUDGETS is set and an endpoint runs more SQL
+    statements than its budget, to catch N+1 patterns in tests
+'''
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+'''
+init_metrics(app)
+    times every request of app: auth (requires_auth), db (every SQL
+    statement, counted by the hooks setup_db installs), serialize (JSON
+    encoding) and the total, sends the breakdown in a Server-Timing
+    header and aggregates it for /metrics
+    QUERY_BUDGETS maps endpoint names to the most statements a request
+    may run, '*' applies to every other endpoint
+'''
+def init_metrics(app):
+    class TimedJSONEncoder(app.json_encoder):
+        def encode(self, o):
+            with timed('serialize'):
+                return super().encode(o)
+
+    app.json_encoder = TimedJSONEncoder
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.timings = dict.fromkeys(PHASES, 0)
+        g.query_count = 0
+
+    @app.after_request
+    def record_timings(response):
+        if 'request_start' not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        timings = g.timings
+        timings['app'] = max(0, total - sum(timings.values()))
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.2f}'.format(phase, seconds * 1000)
+            for phase, seconds in list(timings.items()) + [('total', total)])
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(route, request.method, response.status_code, total,
+                        timings, g.query_count)
+
+        budgets = app.config.get('QUERY_BUDGETS')
+        if budgets:
+            budget = budgets.get(request.endpoint, budgets.get('*'))
+            if budget is not None and g.query_count > budget:
+                raise QueryBudgetExceeded('{} {} ran {} SQL statements, budget is {}'.format(
+                    request.method, request.full_path, g.query_count, budget))
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
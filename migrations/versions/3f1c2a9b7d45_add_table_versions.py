@@ -0,0 +1,32 @@
+"""add table_versions
+
+Revision ID: 3f1c2a9b7d45
+Revises: 
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d45'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'actors', 'version': 1},
+        {'name': 'movies', 'version': 1},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
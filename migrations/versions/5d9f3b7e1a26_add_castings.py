@@ -0,0 +1,37 @@
+"""add castings
+
+Revision ID: 5d9f3b7e1a26
+Revises: c47a9e0d2b18
+Create Date: 2026-10-18 16:25:44.630981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9f3b7e1a26'
+down_revision = 'c47a9e0d2b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('castings',
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['actor_id'], ['actors.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('movie_id', 'actor_id')
+    )
+    op.create_index(op.f('ix_castings_actor_id'), 'castings', ['actor_id'], unique=False)
+    op.bulk_insert(sa.table('table_versions',
+        sa.column('name', sa.String), sa.column('version', sa.Integer)),
+        [{'name': 'castings', 'version': 1}])
+
+
+def downgrade():
+    op.execute("DELETE FROM table_versions WHERE name = 'castings'")
+    op.drop_index(op.f('ix_castings_actor_id'), table_name='castings')
+    op.drop_table('castings')
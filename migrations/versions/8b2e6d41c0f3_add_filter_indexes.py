@@ -0,0 +1,28 @@
+"""add filter indexes on actors and movies
+
+Revision ID: 8b2e6d41c0f3
+Revises: 3f1c2a9b7d45
+Create Date: 2026-10-18 11:40:07.918254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e6d41c0f3'
+down_revision = '3f1c2a9b7d45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age', 'id'], unique=False)
+    op.create_index('ix_actors_age', 'actors', ['age', 'id'], unique=False)
+    op.create_index('ix_movies_year', 'movies', ['year', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movies_year', table_name='movies')
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
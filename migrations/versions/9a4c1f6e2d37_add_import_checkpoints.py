@@ -0,0 +1,29 @@
+"""add import checkpoints
+
+Revision ID: 9a4c1f6e2d37
+Revises: 5d9f3b7e1a26
+Create Date: 2026-10-18 19:02:13.517204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c1f6e2d37'
+down_revision = '5d9f3b7e1a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_checkpoints',
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('rows', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('import_checkpoints')
@@ -0,0 +1,57 @@
+"""add full-text search indexes
+
+Revision ID: c47a9e0d2b18
+Revises: 8b2e6d41c0f3
+Create Date: 2026-10-18 14:03:52.117630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a9e0d2b18'
+down_revision = '8b2e6d41c0f3'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = {'actors': 'name', 'movies': 'title'}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHABLE.items():
+        fts = f'{table}_fts'
+        if dialect == 'sqlite':
+            op.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                f"{column}, content='{table}', content_rowid='id')")
+            op.execute(
+                f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(
+                f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column}) "
+                f"VALUES ('delete', old.id, old.{column}); END")
+            op.execute(
+                f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column}) "
+                f"VALUES ('delete', old.id, old.{column}); "
+                f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        elif dialect == 'postgresql':
+            op.execute(
+                f"CREATE INDEX ix_{table}_{column}_fts ON {table} "
+                f"USING gin (to_tsvector('simple', coalesce({column}, '')))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHABLE.items():
+        fts = f'{table}_fts'
+        if dialect == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER {fts}_{trigger}')
+            op.execute(f'DROP TABLE {fts}')
+        elif dialect == 'postgresql':
+            op.execute(f'DROP INDEX ix_{table}_{column}_fts')
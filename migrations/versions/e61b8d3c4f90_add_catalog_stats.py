@@ -0,0 +1,40 @@
+"""add catalog stats
+
+Revision ID: e61b8d3c4f90
+Revises: 9a4c1f6e2d37
+Create Date: 2026-10-18 21:37:48.204611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61b8d3c4f90'
+down_revision = '9a4c1f6e2d37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_stats',
+    sa.Column('metric', sa.String(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'bucket')
+    )
+    # same counts as models.rebuild_stats
+    for table, columns in [('actors', [('gender', 'gender'), ('age', '(age / 10) * 10')]),
+                           ('movies', [('year', 'year')])]:
+        op.execute(
+            "INSERT INTO catalog_stats (metric, bucket, count) "
+            "SELECT '{table}.total', '', COUNT(*) FROM {table}".format(table=table))
+        for column, value in columns:
+            bucket = "COALESCE(CAST({} AS VARCHAR), '')".format(value)
+            op.execute(
+                "INSERT INTO catalog_stats (metric, bucket, count) "
+                "SELECT '{table}.{column}', {bucket}, COUNT(*) FROM {table} GROUP BY {bucket}"
+                .format(table=table, column=column, bucket=bucket))
+
+def downgrade():
+    op.drop_table('catalog_stats')
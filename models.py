@@ -1,25 +1,166 @@
+import logging
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import (Column, String, Integer, BigInteger, ForeignKey, Index, bindparam,
+                        cast, create_engine, func, inspect, select, text)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.sql.expression import UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
+from metrics import count_query
 
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
 database_path = "sqlite:///{}".format(
     os.path.join(project_dir, database_filename))
 
-db = SQLAlchemy()
+'''
+RoutingSession
+    session of the app: statements run on the primary database, except
+    in a request routed to a replica (g.db_bind, set by init_replicas)
+    where everything but INSERT, UPDATE, DELETE and flushes is read from
+    that replica
+'''
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        bind = g.get('db_bind') if has_request_context() else None
+        if bind is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return db.get_engine(current_app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+logger = logging.getLogger(__name__)
+
+'''
+engine profiles
+    connection settings applied by setup_db
+    - pool_* / max_overflow: connection pool of server databases (Postgres)
+    - sqlite_*: PRAGMAs run on every new SQLite connection. WAL lets
+      readers run while a write is being committed, synchronous=NORMAL
+      is durable in WAL mode with one fsync per checkpoint instead of
+      one per commit
+'''
+DEFAULT_ENGINE_PROFILE = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_pre_ping': True,
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'sqlite_journal_mode': 'WAL',
+    'sqlite_synchronous': 'NORMAL',
+    'sqlite_busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'sqlite_mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'sqlite_foreign_keys': True
+}
+
+# the settings setup_db used before engine profiles, kept for benchmarks
+LEGACY_ENGINE_PROFILE = dict(
+    DEFAULT_ENGINE_PROFILE,
+    pool_pre_ping=False,
+    pool_recycle=-1,
+    sqlite_journal_mode='DELETE',
+    sqlite_synchronous='FULL',
+    sqlite_busy_timeout=5000,
+    sqlite_mmap_size=0,
+    sqlite_foreign_keys=False)
+
+'''
+sqlite_pragmas(profile)
+    the PRAGMA statements of the sqlite_* settings of a profile
+'''
+def sqlite_pragmas(profile):
+    return [
+        'PRAGMA journal_mode={}'.format(profile['sqlite_journal_mode']),
+        'PRAGMA synchronous={}'.format(profile['sqlite_synchronous']),
+        'PRAGMA busy_timeout={:d}'.format(profile['sqlite_busy_timeout']),
+        'PRAGMA mmap_size={:d}'.format(profile['sqlite_mmap_size']),
+        'PRAGMA foreign_keys={}'.format(
+            'ON' if profile['sqlite_foreign_keys'] else 'OFF'),
+    ]
+
+'''
+SQL instrumentation
+    every statement is counted in the current request with its duration,
+    statements slower than SLOW_QUERY_THRESHOLD seconds are logged with
+    their parameters and the route that ran them
+    BEGIN and savepoints are transaction control, like the COMMIT the
+    driver sends itself, and aren't counted
+'''
+slow_query_threshold = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.1))
+TRANSACTION_CONTROL = ('BEGIN', 'SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if statement.startswith(TRANSACTION_CONTROL):
+        return
+    count_query(elapsed)
+    if elapsed >= slow_query_threshold:
+        route = '{} {}'.format(request.method, request.full_path) \
+            if has_request_context() else 'no request'
+        logger.warning('Slow query (%.1f ms) from %s: %s; parameters: %r',
+                       elapsed * 1000, route, statement, parameters)
+
+'''
+_set_sqlite_pragmas(engine, profile)
+    runs the PRAGMAs of profile on every new connection of engine
+'''
+def _set_sqlite_pragmas(engine, profile):
+    registered = hasattr(engine, 'sqlite_pragmas')
+    engine.sqlite_pragmas = sqlite_pragmas(profile)
+    if not registered:
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in engine.sqlite_pragmas:
+                cursor.execute(pragma)
+            cursor.close()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    profile overrides entries of DEFAULT_ENGINE_PROFILE
+    replica_paths are read-only copies of the database, bound as
+    replica_0, replica_1, ... for RoutingSession
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, profile=None, replica_paths=()):
+    profile = dict(DEFAULT_ENGINE_PROFILE, **(profile or {}))
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {
+        'replica_{}'.format(i): path for i, path in enumerate(replica_paths)}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # on the Engine class so every engine of the app is instrumented
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    if not database_path.startswith('sqlite'):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            'pool_size': profile['pool_size'],
+            'max_overflow': profile['max_overflow'],
+            'pool_pre_ping': profile['pool_pre_ping'],
+            'pool_recycle': profile['pool_recycle']
+        }
+    if database_path.startswith('postgres'):
+        # multi-row INSERT ... VALUES for executemany (bulk imports)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]['executemany_mode'] = 'values'
     db.app = app
     db.init_app(app)
 
+    paths = dict(app.config["SQLALCHEMY_BINDS"])
+    paths[None] = database_path
+    for bind, path in paths.items():
+        if path.startswith('sqlite'):
+            _set_sqlite_pragmas(db.get_engine(app, bind), profile)
+
 '''
 db_drop_and_create_all()
     drops the database tables and starts fresh
@@ -61,18 +202,431 @@ def db_test_data():
         ))
     movie2.insert()
 
-    
+    Casting(movie_id=movie1.id, actor_id=actor1.id, role='Chris Gardner').insert()
+    Casting(movie_id=movie2.id, actor_id=actor1.id, role='Deadshot').insert()
+    Casting(movie_id=movie2.id, actor_id=actor2.id, role='Harley Quinn').insert()
+
+
+'''
+TableVersion
+    one row per table holding a counter that is bumped in the same
+    transaction as every insert, update and delete on that table
+    conditional GETs compare against it instead of reading the table
+'''
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+'''
+ImportCheckpoint
+    progress of a bulk import (manage.py import_data): byte position in
+    the source file after the last committed chunk and rows imported so
+    far, committed with each chunk so an interrupted import resumes
+    right after it
+'''
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+
+    source = Column(String, primary_key=True)
+    position = Column(BigInteger, nullable=False, default=0)
+    rows = Column(BigInteger, nullable=False, default=0)
+
+'''
+table_write_listeners
+    callables run with a table name once a transaction that wrote to
+    that table is committed
+'''
+table_write_listeners = []
+
+'''
+bump_table_version(name)
+    increments the version of a table in the current transaction
+'''
+def bump_table_version(name):
+    table = TableVersion.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        db.session.execute(table.insert().values(name=name, version=1))
+    db.session.info.setdefault('written_tables', set()).add(name)
+
+@event.listens_for(SignallingSession, 'after_commit')
+def notify_table_writes(session):
+    for name in session.info.pop('written_tables', ()):
+        for listener in table_write_listeners:
+            listener(name)
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def discard_table_writes(session):
+    session.info.pop('written_tables', None)
+
+'''
+get_table_versions(names)
+    current version of each table in a single query, 0 for a table that
+    has never been written to
+'''
+def get_table_versions(names):
+    table = TableVersion.__table__
+    rows = db.session.execute(
+        select([table.c.name, table.c.version])
+        .where(table.c.name.in_(names))).fetchall()
+    versions = dict.fromkeys(names, 0)
+    versions.update(rows)
+    return versions
+
+'''
+CatalogStat
+    number of actors and movies per bucket of the columns in STATS, kept
+    up to date in the transaction of every write so /stats reads a few
+    rows instead of the tables
+    metric is '<table>.<column>' or '<table>.total', bucket the value
+    ('' for NULL)
+'''
+class CatalogStat(db.Model):
+    __tablename__ = 'catalog_stats'
+
+    metric = Column(String, primary_key=True)
+    bucket = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+# table -> (column, bucket width) pairs counted in catalog_stats,
+# a width of None counts every distinct value
+STATS = {
+    'actors': (('gender', None), ('age', 10)),
+    'movies': (('year', None),),
+}
+
+def _bucket(value, width):
+    if value is None:
+        return ''
+    if width is not None:
+        # truncated like SQL integer division, see rebuild_stats
+        value = int(value / width) * width
+    return str(value)
+
+'''
+stat_buckets(table, row)
+    (metric, bucket) pairs a row of table is counted in, row being
+    anything holding its columns by name
+'''
+def stat_buckets(table, row):
+    return [(table + '.total', '')] + [
+        ('{}.{}'.format(table, column), _bucket(row[column], width))
+        for column, width in STATS[table]]
+
+'''
+committed_values(instance)
+    the columns of STATS as they were before the pending changes of an
+    ORM instance
+'''
+def committed_values(instance):
+    attrs = inspect(instance).attrs
+    values = {}
+    for column, width in STATS[instance.__tablename__]:
+        history = attrs[column].history
+        values[column] = history.deleted[0] if history.deleted else attrs[column].value
+    return values
+
+'''
+adjust_stats(table, old_rows=(), new_rows=())
+    takes old_rows out of their buckets and counts new_rows in, in the
+    current transaction
+    one executemany upsert for all the buckets that changed, buckets
+    that drop to 0 are kept and skipped by catalog_stats
+'''
+def adjust_stats(table, old_rows=(), new_rows=()):
+    deltas = {}
+    for rows, delta in ((old_rows, -1), (new_rows, 1)):
+        for row in rows:
+            for key in stat_buckets(table, row):
+                deltas[key] = deltas.get(key, 0) + delta
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # ON CONFLICT upserts are understood by both SQLite (3.24+) and Postgres
+    db.session.execute(
+        text('INSERT INTO catalog_stats (metric, bucket, count) '
+             'VALUES (:metric, :bucket, :delta) '
+             'ON CONFLICT (metric, bucket) '
+             'DO UPDATE SET count = catalog_stats.count + excluded.count'),
+        [{'metric': metric, 'bucket': bucket, 'delta': delta}
+         for (metric, bucket), delta in deltas.items()])
+
+'''
+catalog_stats()
+    totals and counts per bucket of actors and movies, from catalog_stats
+'''
+def catalog_stats():
+    stats = CatalogStat.__table__
+    rows = db.session.execute(
+        select([stats.c.metric, stats.c.bucket, stats.c.count])
+        .where(stats.c.count > 0)
+        .order_by(stats.c.metric, stats.c.bucket))
+
+    result = {}
+    for table, columns in STATS.items():
+        result[table] = {'total': 0}
+        for column, width in columns:
+            result[table]['by_' + column] = []
+    for metric, bucket, count in rows:
+        table, column = metric.split('.')
+        if column == 'total':
+            result[table]['total'] = count
+            continue
+
+        width = dict(STATS[table])[column]
+        integer = isinstance(db.metadata.tables[table].c[column].type, Integer)
+        value = None if bucket == '' else int(bucket) if integer else bucket
+        if width is None:
+            entry = {column: value}
+        else:
+            entry = {column + '_from': value,
+                     column + '_to': None if value is None else value + width - 1}
+        entry['count'] = count
+        result[table]['by_' + column].append(entry)
+
+    for table in result.values():
+        for column, entries in table.items():
+            if column != 'total':
+                # NULL first, then by value
+                entries.sort(key=lambda entry: [(v is not None, v) for v in entry.values()])
+    return result
+
+'''
+table_total(name)
+    number of rows of actors or movies, read from catalog_stats
+'''
+def table_total(name):
+    stats = CatalogStat.__table__
+    total = db.session.execute(
+        select([stats.c.count])
+        .where(stats.c.metric == name + '.total')
+        .where(stats.c.bucket == '')).scalar()
+    return total or 0
+
+'''
+rebuild_stats()
+    recomputes catalog_stats from the tables, one GROUP BY per column,
+    to repair counts that drifted (e.g. rows changed outside the app)
+'''
+def rebuild_stats():
+    stats = CatalogStat.__table__
+    db.session.execute(stats.delete())
+    for name, columns in STATS.items():
+        table = db.metadata.tables[name]
+        rows = [{'metric': name + '.total', 'bucket': '',
+                 'count': db.session.execute(select([func.count()]).select_from(table)).scalar()}]
+        for column, width in columns:
+            value = table.c[column] if width is None else (table.c[column] / width) * width
+            bucket = func.coalesce(cast(value, String), '')
+            rows += [{'metric': '{}.{}'.format(name, column), 'bucket': bucket_value, 'count': count}
+                     for bucket_value, count in db.session.execute(
+                         select([bucket, func.count()]).select_from(table).group_by(bucket))]
+        db.session.execute(stats.insert(), rows)
+    db.session.commit()
+
+'''
+bulk_insert(model, rows)
+    inserts a list of column dicts with a single commit and returns the
+    new ids in the same order as rows
+'''
+def bulk_insert(model, rows):
+    db.session.bulk_insert_mappings(model, rows, return_defaults=True)
+    adjust_stats(model.__tablename__, new_rows=rows)
+    bump_table_version(model.__tablename__)
+    db.session.commit()
+    return [row['id'] for row in rows]
+
+'''
+_locked_rows(table, where)
+    the rows of table matching where, read after taking the write lock so
+    they can't change or go away before the transaction ends: FOR UPDATE
+    on server databases, BEGIN IMMEDIATE on SQLite where the lock covers
+    the whole database (a transaction that already wrote holds it)
+    stats deltas are computed from these rows, a row read before the
+    lock could be counted twice by concurrent writes
+'''
+def _locked_rows(table, where):
+    statement = select([table]).where(where)
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        statement = statement.with_for_update()
+    elif not connection.connection.in_transaction:
+        connection.execute('BEGIN IMMEDIATE')
+    return db.session.execute(statement).fetchall()
+
+'''
+update_row(model, row_id, values)
+    single UPDATE of only the given columns of one row, with RETURNING
+    where the backend supports it, and a commit
+    returns the columns of the updated row, None when there is no row
+    with that id
+'''
+def update_row(model, row_id, values):
+    table = model.__table__
+    if not values:
+        row = db.session.execute(
+            select([table]).where(table.c.id == row_id)).first()
+        return None if row is None else dict(row)
+
+    old = None
+    if any(column in values for column, width in STATS[table.name]):
+        rows = _locked_rows(table, table.c.id == row_id)
+        if not rows:
+            db.session.rollback()
+            return None
+        old = rows[0]
+
+    statement = table.update().where(table.c.id == row_id).values(**values)
+    returning = db.session.get_bind().dialect.implicit_returning
+    if returning:
+        row = db.session.execute(statement.returning(*table.c)).first()
+        found = row is not None
+    else:
+        found = db.session.execute(statement).rowcount > 0
+    if not found:
+        db.session.rollback()
+        return None
+
+    if not returning:
+        row = dict(old, **values) if old is not None else db.session.execute(
+            select([table]).where(table.c.id == row_id)).first()
+    if old is not None:
+        adjust_stats(table.name, [old], [row])
+    bump_table_version(model.__tablename__)
+    db.session.commit()
+    return dict(row)
+
+'''
+_delete_cascades(model, ids)
+    deletes the rows of relationships that cascade deletes (Actor.castings,
+    Movie.cast) for the given ids in one statement each, whether or not
+    the backend enforces foreign keys
+'''
+def _delete_cascades(model, ids):
+    for rel in model.__mapper__.relationships:
+        if not rel.cascade.delete:
+            continue
+        for local, remote in rel.local_remote_pairs:
+            db.session.execute(remote.table.delete().where(remote.in_(ids)))
+        bump_table_version(rel.target.name)
+
+'''
+_delete_returning(model, ids)
+    deletes the rows of model with one of ids and their cascades
+    returns the rows the DELETE removed, from RETURNING where the backend
+    supports it, read under the write lock otherwise, so a row deleted
+    by a concurrent request is never counted twice
+'''
+def _delete_returning(model, ids):
+    table = model.__table__
+    if db.session.get_bind().dialect.implicit_returning:
+        _delete_cascades(model, ids)
+        return db.session.execute(
+            table.delete().where(table.c.id.in_(ids)).returning(*table.c)).fetchall()
+
+    rows = _locked_rows(table, table.c.id.in_(ids))
+    if rows:
+        found = [row.id for row in rows]
+        _delete_cascades(model, found)
+        deleted = db.session.execute(table.delete().where(table.c.id.in_(found))).rowcount
+        if deleted != len(rows):
+            raise RuntimeError('{} of {} locked rows deleted'.format(deleted, len(rows)))
+    return rows
+
+'''
+delete_row(model, row_id)
+    single DELETE of one row and its cascades in one transaction and a
+    commit
+    returns False when there is no row with that id
+'''
+def delete_row(model, row_id):
+    rows = _delete_returning(model, [row_id])
+    if not rows:
+        db.session.rollback()
+        return False
+
+    table = model.__table__
+    adjust_stats(table.name, old_rows=rows)
+    bump_table_version(model.__tablename__)
+    db.session.commit()
+    return True
+
+'''
+update_rows(model, items)
+    partial updates of many rows in one transaction, items being column
+    dicts holding the id of their row
+    rows changing the same columns share one executemany UPDATE
+    returns the set of ids that had a row, the others are skipped
+'''
+def update_rows(model, items):
+    table = model.__table__
+    rows = _locked_rows(table, table.c.id.in_([item['id'] for item in items]))
+    found = {row.id: dict(row) for row in rows}
+
+    groups = {}
+    for item in items:
+        columns = tuple(sorted(key for key in item if key != 'id'))
+        if item['id'] in found and columns:
+            groups.setdefault(columns, []).append(item)
+
+    for columns, group in groups.items():
+        statement = (table.update()
+                     .where(table.c.id == bindparam('_id'))
+                     .values({column: bindparam(column) for column in columns}))
+        db.session.execute(statement, [
+            dict({column: item[column] for column in columns}, _id=item['id'])
+            for item in group])
+
+    if groups:
+        updated = [item for item in items if item['id'] in found]
+        adjust_stats(table.name, [found[item['id']] for item in updated],
+                     [dict(found[item['id']], **item) for item in updated])
+        bump_table_version(model.__tablename__)
+    db.session.commit()
+    return set(found)
+
+'''
+delete_rows(model, ids)
+    deletes many rows and their cascades in one transaction, one
+    statement per table
+    returns the set of ids that had a row
+'''
+def delete_rows(model, ids):
+    rows = _delete_returning(model, ids)
+    if not rows:
+        db.session.rollback()
+        return set()
+
+    table = model.__table__
+    adjust_stats(table.name, old_rows=rows)
+    bump_table_version(model.__tablename__)
+    db.session.commit()
+    return {row.id for row in rows}
+
 '''
 Actor
 '''
 class Actor(db.Model):  
     __tablename__ = 'actors'
+    __table_args__ = (
+        Index('ix_actors_gender_age', 'gender', 'age', 'id'),
+        Index('ix_actors_age', 'age', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     gender = Column(String)
     age = Column(Integer)
 
+    castings = relationship('Casting', back_populates='actor',
+                            cascade='all, delete-orphan')
+
     def __init__(self, name, gender, age):
         self.name = name
         self.gender = gender
@@ -80,13 +634,20 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        adjust_stats(self.__tablename__, new_rows=[self.format()])
+        bump_table_version(self.__tablename__)
         db.session.commit()
   
     def update(self):
+        adjust_stats(self.__tablename__, [committed_values(self)], [self.format()])
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        adjust_stats(self.__tablename__, old_rows=[self.format()])
+        bump_table_version(self.__tablename__)
+        bump_table_version(Casting.__tablename__)
         db.session.commit()
 
     def format(self):
@@ -97,29 +658,46 @@ class Actor(db.Model):
             'age': self.age
         }
 
+    def format_cast(self):
+        return [dict(casting.movie.format(), role=casting.role)
+                for casting in self.castings]
+
 '''
 Movie
 '''
 class Movie(db.Model):
     __tablename__ = 'movies'
+    __table_args__ = (
+        Index('ix_movies_year', 'year', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String)
     year = Column(Integer)
 
+    cast = relationship('Casting', back_populates='movie',
+                        cascade='all, delete-orphan')
+
     def __init__(self, title, year):
         self.title = title
         self.year = year
 
     def insert(self):
         db.session.add(self)
+        adjust_stats(self.__tablename__, new_rows=[self.format()])
+        bump_table_version(self.__tablename__)
         db.session.commit()
   
     def update(self):
+        adjust_stats(self.__tablename__, [committed_values(self)], [self.format()])
+        bump_table_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        adjust_stats(self.__tablename__, old_rows=[self.format()])
+        bump_table_version(self.__tablename__)
+        bump_table_version(Casting.__tablename__)
         db.session.commit()
 
     def format(self):
@@ -127,4 +705,50 @@ class Movie(db.Model):
             'id': self.id,
             'title': self.title,
             'year': self.year
+        }
+
+    def format_cast(self):
+        return [dict(casting.actor.format(), role=casting.role)
+                for casting in self.cast]
+
+'''
+Casting
+    assigns an actor to a movie, with the role they play in it
+'''
+class Casting(db.Model):
+    __tablename__ = 'castings'
+
+    movie_id = Column(Integer, ForeignKey('movies.id', ondelete='CASCADE'),
+                      primary_key=True)
+    actor_id = Column(Integer, ForeignKey('actors.id', ondelete='CASCADE'),
+                      primary_key=True, index=True)
+    role = Column(String)
+
+    movie = relationship('Movie', back_populates='cast')
+    actor = relationship('Actor', back_populates='castings')
+
+    def __init__(self, movie_id, actor_id, role):
+        self.movie_id = movie_id
+        self.actor_id = actor_id
+        self.role = role
+
+    def insert(self):
+        db.session.add(self)
+        bump_table_version(self.__tablename__)
+        db.session.commit()
+
+    def update(self):
+        bump_table_version(self.__tablename__)
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        bump_table_version(self.__tablename__)
+        db.session.commit()
+
+    def format(self):
+        return {
+            'movie_id': self.movie_id,
+            'actor_id': self.actor_id,
+            'role': self.role
         }
\ No newline at end of file
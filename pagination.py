@@ -0,0 +1,152 @@
+import base64
+import json
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+from models import db, table_total
+
+'''
+encode_cursor(values)
+    opaque keyset cursor: url-safe base64 of the sort key of the last row
+    of a page, so the next page starts right after it without an OFFSET
+'''
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+'''
+decode_cursor(cursor)
+    inverse of encode_cursor, aborts with 400 on a malformed cursor
+'''
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        abort(400)
+
+    if not isinstance(values, list) or not values:
+        abort(400)
+
+    return values
+
+'''
+get_page_size()
+    ?limit= from the query string, capped at MAX_PAGE_SIZE
+'''
+def get_page_size():
+    limit = request.args.get('limit')
+    if limit is None:
+        return current_app.config['PAGE_SIZE']
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+
+    if limit < 1:
+        abort(400)
+
+    return min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+'''
+total_count(query, name)
+    number of rows query selects from the actors or movies table name,
+    from catalog_stats without touching the table when query isn't
+    filtered, with a COUNT of the filtered rows otherwise
+'''
+def total_count(query, name):
+    if query.whereclause is None:
+        return table_total(name)
+    return query.order_by(None).count()
+
+'''
+order_by(query, model, sort)
+    orders query by the sort column, then by primary key so the order is
+    total and every row has a unique keyset position
+    sort is a (column, descending) pair, None means ascending by id
+'''
+def order_by(query, model, sort=None):
+    column, descending = sort or (model.id, False)
+    if column is model.id:
+        return query.order_by(column.desc() if descending else column)
+    if descending:
+        return query.order_by(column.desc(), model.id.desc())
+    return query.order_by(column, model.id)
+
+'''
+_nulls_first(descending)
+    whether NULLs come first in the given direction on the current
+    backend: SQLite sorts NULL as the smallest value, Postgres as the
+    largest
+'''
+def _nulls_first(descending):
+    nulls_smallest = db.session.get_bind().dialect.name in ('sqlite', 'mysql')
+    return nulls_smallest != descending
+
+'''
+_after(model, column, descending, value, last_id)
+    WHERE clause selecting the rows that come after (value, last_id)
+    in the order built by order_by
+'''
+def _after(model, column, descending, value, last_id):
+    id_after = model.id < last_id if descending else model.id > last_id
+    if column is model.id:
+        return id_after
+
+    if _nulls_first(descending):
+        if value is None:
+            return or_(and_(column.is_(None), id_after), column.isnot(None))
+        column_after = column < value if descending else column > value
+        return or_(column_after, and_(column == value, id_after))
+
+    if value is None:
+        return and_(column.is_(None), id_after)
+    column_after = column < value if descending else column > value
+    return or_(column_after, and_(column == value, id_after), column.is_(None))
+
+'''
+_valid_cursor_value(column, value)
+    whether a value decoded from a cursor can be compared with column:
+    an int (not a bool) for integer columns, a str for text ones, None
+    for a NULL sort key
+'''
+def _valid_cursor_value(column, value):
+    if value is None:
+        return not column.primary_key
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, column.type.python_type)
+
+'''
+paginate(query, model, sort=None)
+    returns one page of query in sort order and the cursor of the next
+    page (None on the last page)
+'''
+def paginate(query, model, sort=None):
+    column, descending = sort or (model.id, False)
+    limit = get_page_size()
+    after = request.args.get('after')
+
+    query = order_by(query, model, sort)
+    if after is not None:
+        values = decode_cursor(after)
+        expected = 1 if column is model.id else 2
+        if len(values) != expected or not _valid_cursor_value(model.id, values[-1]) \
+                or not _valid_cursor_value(column, values[0]):
+            abort(400)
+        last_id = values[-1]
+        query = query.filter(
+            _after(model, column, descending, values[0], last_id))
+
+    # one extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if column is model.id:
+            next_cursor = encode_cursor([last.id])
+        else:
+            next_cursor = encode_cursor([getattr(last, column.key), last.id])
+
+    return rows, next_cursor
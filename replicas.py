@@ -0,0 +1,110 @@
+import itertools
+import logging
+import threading
+import time
+import weakref
+from flask import g, request
+from sqlalchemy import event, select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from models import db, TableVersion
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'madb_primary'
+
+logger = logging.getLogger(__name__)
+
+'''
+replica_binds(app)
+    names of the replica binds setup_db configured, in order
+'''
+def replica_binds(app):
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    return sorted(name for name in binds if name.startswith('replica_'))
+
+'''
+ReplicaRouter
+    picks the replica a read request runs on, round-robin over the
+    healthy ones
+    a replica is probed with a one-row read of table_versions at most
+    every REPLICA_CHECK_INTERVAL seconds, and is unhealthy until the
+    next probe once it loses a connection or fails operationally, errors
+    caused by the statement itself leave it healthy
+'''
+class ReplicaRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.health = weakref.WeakKeyDictionary()
+
+    def set_health(self, engine, healthy):
+        with self._lock:
+            was_healthy = self.health.get(engine, (0, True))[1]
+            self.health[engine] = (time.monotonic(), healthy)
+        if was_healthy and not healthy:
+            logger.warning('Replica %s (%r) is unhealthy, its reads go to the primary',
+                           engine.replica_name, engine.url)
+
+    def _engine(self, app, name):
+        engine = db.get_engine(app, name)
+        if not hasattr(engine, 'replica_name'):
+            engine.replica_name = name
+
+            @event.listens_for(engine, 'handle_error')
+            def mark_unhealthy(context):
+                # a lost or refused connection, not a statement the
+                # replica rejected (bad parameters, constraints)
+                if context.is_disconnect or isinstance(
+                        context.sqlalchemy_exception, (OperationalError, InterfaceError)):
+                    self.set_health(engine, False)
+        return engine
+
+    def healthy(self, app, name):
+        engine = self._engine(app, name)
+        checked_at, healthy = self.health.get(engine, (None, None))
+        if checked_at is not None and \
+                time.monotonic() - checked_at < app.config['REPLICA_CHECK_INTERVAL']:
+            return healthy
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(select([TableVersion.name]).limit(1))
+        except DBAPIError:
+            self.set_health(engine, False)
+            return False
+        self.set_health(engine, True)
+        return True
+
+    def pick(self, app, names):
+        start = next(self._counter)
+        for i in range(len(names)):
+            name = names[(start + i) % len(names)]
+            if self.healthy(app, name):
+                return name
+        return None
+
+
+replica_router = ReplicaRouter()
+
+'''
+init_replicas(app)
+    routes read requests of app to a replica when setup_db was given
+    some, writes always go to the primary
+    a successful write sets a short-lived cookie (REPLICA_PIN_SECONDS)
+    pinning the client's following reads to the primary, so it reads
+    its own writes despite replication lag
+    reads fall back to the primary when no replica is healthy
+'''
+def init_replicas(app):
+    @app.before_request
+    def route_reads():
+        names = replica_binds(app)
+        if names and request.method in READ_METHODS and PIN_COOKIE not in request.cookies:
+            g.db_bind = replica_router.pick(app, names)
+
+    @app.after_request
+    def pin_writes(response):
+        if replica_binds(app) and request.method not in READ_METHODS \
+                and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=app.config['REPLICA_PIN_SECONDS'],
+                                httponly=True)
+        return response
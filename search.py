@@ -0,0 +1,136 @@
+import re
+from flask import abort, request
+from sqlalchemy import DDL, event, text
+from models import db, Actor, Movie
+from pagination import decode_cursor, encode_cursor, get_page_size
+
+# table -> the text column that is indexed
+SEARCHABLE = {'actors': 'name', 'movies': 'title'}
+KINDS = {'actor': Actor, 'movie': Movie}
+
+'''
+Full-text index DDL
+    SQLite: an external-content FTS5 table per searchable table, kept in
+    sync row by row by triggers, so writes never need a full rebuild
+    Postgres: a GIN index on the to_tsvector expression, maintained by
+    Postgres itself
+'''
+def sqlite_fts_ddl(table, column):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+def postgres_fts_ddl(table, column):
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_fts ON {table} "
+        f"USING gin (to_tsvector('simple', coalesce({column}, '')))",
+    ]
+
+# keep the index in place when the schema is built with db.create_all()
+for _table, _column in SEARCHABLE.items():
+    _model_table = db.Model.metadata.tables[_table]
+    for _statement in sqlite_fts_ddl(_table, _column):
+        event.listen(_model_table, 'after_create',
+                     DDL(_statement).execute_if(dialect='sqlite'))
+    for _statement in postgres_fts_ddl(_table, _column):
+        event.listen(_model_table, 'after_create',
+                     DDL(_statement).execute_if(dialect='postgresql'))
+    event.listen(_model_table, 'before_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_table}_fts')
+                 .execute_if(dialect='sqlite'))
+
+'''
+fts_query(q)
+    turns free text into an FTS5 query matching every word, each word
+    quoted so user input can never be parsed as FTS5 syntax
+'''
+def fts_query(q):
+    words = re.findall(r'\w+', q)
+    return ' '.join('"{}"'.format(word) for word in words)
+
+'''
+_hits_sql(dialect)
+    ranked hits of both tables as (kind, id, rank), lower rank is better
+'''
+def _hits_sql(dialect):
+    if dialect == 'sqlite':
+        return (
+            "SELECT 'actor' AS kind, rowid AS id, bm25(actors_fts) AS rank "
+            "FROM actors_fts WHERE actors_fts MATCH :q "
+            "UNION ALL "
+            "SELECT 'movie' AS kind, rowid AS id, bm25(movies_fts) AS rank "
+            "FROM movies_fts WHERE movies_fts MATCH :q")
+    if dialect == 'postgresql':
+        return (
+            "SELECT 'actor' AS kind, id, -ts_rank(to_tsvector('simple', "
+            "coalesce(name, '')), plainto_tsquery('simple', :q)) AS rank "
+            "FROM actors WHERE to_tsvector('simple', coalesce(name, '')) "
+            "@@ plainto_tsquery('simple', :q) "
+            "UNION ALL "
+            "SELECT 'movie' AS kind, id, -ts_rank(to_tsvector('simple', "
+            "coalesce(title, '')), plainto_tsquery('simple', :q)) AS rank "
+            "FROM movies WHERE to_tsvector('simple', coalesce(title, '')) "
+            "@@ plainto_tsquery('simple', :q)")
+    abort(501)
+
+'''
+search(q)
+    one page of ranked hits across actors and movies, and the cursor of
+    the next page (None on the last page)
+    pages are keyset-paginated on (rank, kind, id)
+'''
+def search(q):
+    if not fts_query(q):
+        abort(400)
+
+    dialect = db.session.get_bind().dialect.name
+    limit = get_page_size()
+    params = {'q': fts_query(q) if dialect == 'sqlite' else q,
+              'limit': limit + 1}
+
+    sql = 'SELECT kind, id, rank FROM ({}) AS hits'.format(_hits_sql(dialect))
+    after = request.args.get('after')
+    if after is not None:
+        values = decode_cursor(after)
+        if len(values) != 3 or values[1] not in KINDS or \
+                not isinstance(values[2], int):
+            abort(400)
+        sql += (' WHERE rank > :rank OR (rank = :rank AND '
+                '(kind > :kind OR (kind = :kind AND id > :id)))')
+        params.update(rank=values[0], kind=values[1], id=values[2])
+    sql += ' ORDER BY rank, kind, id LIMIT :limit'
+
+    hits = db.session.execute(text(sql), params).fetchall()
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last = hits[-1]
+        next_cursor = encode_cursor([last.rank, last.kind, last.id])
+
+    # one query per table for the rows of the page
+    records = {}
+    for kind, model in KINDS.items():
+        ids = [hit.id for hit in hits if hit.kind == kind]
+        if ids:
+            for row in model.query.filter(model.id.in_(ids)):
+                records[kind, row.id] = row.format()
+
+    results = [{
+        'type': hit.kind,
+        'rank': hit.rank,
+        hit.kind: records[hit.kind, hit.id]
+    } for hit in hits if (hit.kind, hit.id) in records]
+
+    return results, next_cursor
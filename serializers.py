@@ -0,0 +1,64 @@
+import re
+from functools import lru_cache
+from flask import current_app, jsonify
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# what the stdlib encoder escapes with JSON_AS_ASCII and orjson does not
+_NOT_PRINTABLE_ASCII = re.compile(rb'[^\x20-\x7e]')
+
+'''
+row_serializer(keys)
+    function turning a row tuple into the dict format() returns, keys
+    being the names of the leading columns of the row (zip stops at the
+    last key, leaving out the id and sort columns added for the cursor)
+    built once per list of keys
+'''
+@lru_cache(maxsize=None)
+def row_serializer(keys):
+    return lambda row: dict(zip(keys, row))
+
+'''
+select_rows(query, columns, fields=None, sort=None)
+    read-only fast path: narrows query to plain row tuples of the
+    requested fields (all of columns by default), plus the id and sort
+    column the next page cursor is built from, so no ORM instances are
+    built or tracked in the identity map
+    returns the query and the serializer of its rows
+'''
+def select_rows(query, columns, fields=None, sort=None):
+    keys = tuple(fields or columns)
+    extra = ('id', sort[0].key if sort is not None else 'id')
+    selected = keys + tuple(key for key in dict.fromkeys(extra) if key not in keys)
+
+    query = query.with_entities(*[columns[key] for key in selected])
+    return query, row_serializer(keys)
+
+'''
+fast_jsonify(payload)
+    same response as jsonify(payload), byte for byte, encoded with
+    orjson when it is installed
+    falls back to jsonify for pretty printing (debug), JSON_AS_ASCII off
+    and payloads orjson can't encode or would encode differently
+    (non-ASCII text)
+'''
+def fast_jsonify(payload):
+    config = current_app.config
+    if (orjson is None or current_app.debug or not config['JSON_AS_ASCII']
+            or config['JSONIFY_PRETTYPRINT_REGULAR']):
+        return jsonify(payload)
+
+    option = orjson.OPT_SORT_KEYS if config['JSON_SORT_KEYS'] else 0
+    with timed('serialize'):
+        try:
+            body = orjson.dumps(payload, option=option)
+        except orjson.JSONEncodeError:
+            body = None
+    if body is None or _NOT_PRINTABLE_ASCII.search(body):
+        return jsonify(payload)
+
+    return current_app.response_class(body + b'\n', mimetype=config['JSONIFY_MIMETYPE'])
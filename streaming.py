@@ -0,0 +1,67 @@
+import json
+from itertools import chain, islice
+from flask import Response, abort, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+'''
+stream_format()
+    how the client asked for the whole table to be streamed
+    - 'ndjson' when NDJSON is preferred in Accept
+    - 'json' with ?stream=1
+    - None for a regular paginated response
+'''
+def stream_format():
+    accept = request.accept_mimetypes
+    if accept[NDJSON_MIMETYPE] > accept['application/json']:
+        return 'ndjson'
+    if request.args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+'''
+_batches(rows, size)
+    groups an iterator of rows into lists of at most size rows
+'''
+def _batches(rows, size):
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+'''
+stream_query(query, key, fmt, format_row)
+    streams every row of query without materializing the table
+    rows are fetched EXPORT_BATCH_SIZE at a time (yield_per) and each
+    batch is encoded into a single chunk
+    - 'ndjson': one formatted row per line
+    - 'json': the document the paginated endpoint returns,
+      {"success": true, "<key>": [...]}, written incrementally
+'''
+def stream_query(query, key, fmt, format_row=lambda row: row.format()):
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    rows = iter(query.yield_per(batch_size))
+    first = next(rows, None)
+    if first is None:
+        abort(404)
+    rows = chain([first], rows)
+
+    if fmt == 'ndjson':
+        def generate():
+            for batch in _batches(rows, batch_size):
+                yield ''.join(json.dumps(format_row(row)) + '\n' for row in batch)
+
+        return Response(stream_with_context(generate()),
+                        mimetype=NDJSON_MIMETYPE)
+
+    def generate():
+        yield '{"success": true, "%s": [' % key
+        separator = ''
+        for batch in _batches(rows, batch_size):
+            yield separator + ', '.join(json.dumps(format_row(row)) for row in batch)
+            separator = ', '
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
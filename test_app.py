@@ -1,30 +1,135 @@
+import gzip
+import io
 import os
+import sqlite3
+import tempfile
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from flask import jsonify
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 
+import models
+import serializers
+import transfer
 from app import create_app
-from models import db, setup_db, db_drop_and_create_all, Actor, Movie
+from admission import AdmissionLimiter, limiter
+from cache import LRUBackend, response_cache
+from metrics import QueryBudgetExceeded
+from pagination import encode_cursor
+from replicas import replica_router
+from auth import JWKSStore, TokenCache
+from local_auth import JWKSServer, LocalSigner
+from models import db, db_test_data, Actor, Movie, Casting
 
-token_ep = {'Authorization': 'Bearer {}'.format(os.getenv('EXECUTIVE_PRODUCER'))}
-token_cd = {'Authorization': 'Bearer {}'.format(os.getenv('CASTING_DIRECTOR'))}
-token_ca = {'Authorization': 'Bearer {}'.format(os.getenv('CASTING_ASSISTANT'))}
+# tokens signed with a local key whose JWKS is served to the app, so the
+# real verify_decode_jwt runs without reaching Auth0
+signer = LocalSigner(bits=1024)
+jwks_server = JWKSServer(signer).start()
+token_ep = {'Authorization': 'Bearer {}'.format(signer.role_token('executive_producer'))}
+token_cd = {'Authorization': 'Bearer {}'.format(signer.role_token('casting_director'))}
+token_ca = {'Authorization': 'Bearer {}'.format(signer.role_token('casting_assistant'))}
+
+# one database file per process, so parallel workers (pytest -n) don't
+# share it
+database_fd, database_file = tempfile.mkstemp(prefix='madb-test-', suffix='.db')
+TEST_CONFIG = {
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database_file,
+    'JWKS_URL': jwks_server.url
+}
+
+# most SQL statements a request to each endpoint may run, catches N+1 queries
+QUERY_BUDGETS = {
+    'get_actors': 4,
+    'get_actor': 2,
+    'get_actor_movies': 3,
+    'get_movies': 4,
+    'get_movie': 2,
+    'get_movie_cast': 3,
+    'search_catalog': 3,
+    'get_catalog_stats': 2,
+    'add_actor': 3,
+    'add_movie': 3,
+    'update_actor': 4,
+    'update_movie': 4,
+    'delete_actor': 6,
+    'delete_movie': 6,
+    'update_actors': 5,
+    'update_movies': 5,
+    'delete_actors': 6,
+    'delete_movies': 6,
+    'add_casting': 4,
+    'delete_casting': 4
+}
+
+
+def setUpModule():
+    """Create the schema and the sample data once for the whole run."""
+    with create_app(TEST_CONFIG).app_context():
+        db.create_all()
+        db_test_data()
+        db.session.remove()
+
+
+def tearDownModule():
+    jwks_server.shutdown()
+    jwks_server.server_close()
+    os.close(database_fd)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database_file + suffix):
+            os.remove(database_file + suffix)
+
+
+def transactional_session(engine):
+    """Session on a connection whose transaction is rolled back at the end
+    of the test. The commits of the app release a SAVEPOINT that is opened
+    again right away, so nothing a test writes ever reaches the file.
+    pysqlite begins transactions on its own and breaks SAVEPOINTs, so the
+    BEGIN is sent explicitly instead."""
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN')
+
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = db.create_scoped_session(options={'bind': connection, 'binds': {}})
+    session.begin_nested()
+
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, ended):
+        if ended.nested and not ended._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def rollback():
+        session.remove()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
+
+    return session, rollback
 
 
 class CastingAgencyTestCase(unittest.TestCase):
     """This class represents the casting agency test case"""
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app(TEST_CONFIG)
+        self.app.config['QUERY_BUDGETS'] = QUERY_BUDGETS
         self.client = self.app.test_client
-        self.database_filename = "database.db"
-        self.project_dir = os.path.dirname(os.path.abspath(__file__))
-        self.database_path = "sqlite:///{}".format(
-            os.path.join(self.project_dir, self.database_filename))
-        setup_db(self.app, self.database_path)
-        
-        db_drop_and_create_all()
-        
+
+        # every test runs in a transaction rolled back by tearDown
+        session, self.rollback = transactional_session(db.get_engine(self.app))
+        self.session, db.session = db.session, session
+
         # test data
         self.new_actor = {
             'name': 'Obi Won Konobe',
@@ -36,16 +141,19 @@ class CastingAgencyTestCase(unittest.TestCase):
             'year': 1920
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after each test"""
-        pass
+        db.session = self.session
+        self.rollback()
+
+    def test_sqlite_engine_profile(self):
+        with create_app(TEST_CONFIG).app_context() as context:
+            with db.get_engine(context.app).connect() as connection:
+                journal_mode = connection.execute('PRAGMA journal_mode').scalar()
+                foreign_keys = connection.execute('PRAGMA foreign_keys').scalar()
+
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(foreign_keys, 1)
 
     """
     Test endpoints GET:
@@ -58,6 +166,191 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['actors'])
 
+    def test_get_actors_paginated(self):
+        res = self.client().get('/actors?limit=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+        self.assertTrue(data['next'])
+
+        res = self.client().get(f'/actors?limit=1&after={data["next"]}', headers=token_ca)
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(next_page['actors']), 1)
+        self.assertGreater(next_page['actors'][0]['id'], data['actors'][0]['id'])
+        self.assertIsNone(next_page['next'])
+
+    def test_400_get_actors_bad_cursor(self):
+        res = self.client().get('/actors?after=not-a-cursor', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_400_get_actors_cursor_of_wrong_type(self):
+        for sort, values in [('age', [[1], 1]), ('age', [{'a': 1}, 1]), ('age', ['old', 1]),
+                             ('name', [1, 1]), ('age', [30, True]), ('id', [True])]:
+            res = self.client().get('/actors?sort={}&after={}'.format(sort, encode_cursor(values)),
+                                    headers=token_ca)
+
+            self.assertEqual(res.status_code, 400, (sort, values))
+
+    def test_get_actors_streamed(self):
+        res = self.client().get('/actors?stream=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['actors']), Actor.query.count())
+
+    def test_get_actors_ndjson(self):
+        headers = dict(token_ca, Accept='application/x-ndjson')
+        res = self.client().get('/actors', headers=headers)
+        actors = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(actors), Actor.query.count())
+        self.assertTrue(actors[0]['name'])
+
+    def test_get_actor(self):
+        actor_id = Actor.query.first().id
+        res = self.client().get(f'/actors/{actor_id}', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['actor']['id'], actor_id)
+
+    def test_404_get_actor_not_found(self):
+        res = self.client().get('/actors/999999', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_304_get_actors_not_modified(self):
+        res = self.client().get('/actors', headers=token_ca)
+        etag = res.headers['ETag']
+
+        res = self.client().get('/actors', headers=dict(token_ca, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_actors_etag_changes_on_write(self):
+        res = self.client().get('/actors', headers=token_ca)
+        etag = res.headers['ETag']
+
+        self.client().post('/actors', json=self.new_actor, headers=token_cd)
+        res = self.client().get('/actors', headers=dict(token_ca, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_actors_filtered(self):
+        res = self.client().get('/actors?gender=Female&min_age=20&max_age=30', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Margot Robbie'])
+
+    def test_get_actors_sorted_across_pages(self):
+        Actor(name='Ageless', gender='unknown', age=None).insert()
+        Actor(name='Twin', gender='Male', age=51).insert()
+        expected = sorted(
+            (actor.format() for actor in Actor.query.all()),
+            key=lambda actor: (actor['age'] is not None, actor['age'] or 0, actor['id']),
+            reverse=True)
+
+        actors = []
+        url = '/actors?sort=-age&limit=1'
+        while url:
+            data = json.loads(self.client().get(url, headers=token_ca).data)
+            actors += data['actors']
+            url = data['next'] and f'/actors?sort=-age&limit=1&after={data["next"]}'
+
+        self.assertEqual([actor['id'] for actor in actors], [actor['id'] for actor in expected])
+
+    def test_400_get_actors_bad_filter(self):
+        res = self.client().get('/actors?min_age=old', headers=token_ca)
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().get('/actors?sort=gender', headers=token_ca)
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_cached(self):
+        first = self.client().get('/actors', headers=token_ca)
+        hits = response_cache.stats()['hits']
+        second = self.client().get('/actors', headers=token_ca)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+
+    def test_head_actors_counts(self):
+        res = self.client().head('/actors', headers=token_ca)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['X-Total-Count'], str(Actor.query.count()))
+
+        res = self.client().head('/actors?gender=Male', headers=token_ca)
+        self.assertEqual(res.headers['X-Total-Count'], '1')
+
+    def test_get_actors_when_total_count_drifted(self):
+        models.CatalogStat.query.delete()
+        db.session.commit()
+        first = self.client().get('/actors?limit=1', headers=token_ca)
+        second = self.client().get('/actors?limit=1&after={}'.format(json.loads(first.data)['next']),
+                                   headers=token_ca)
+        head = self.client().head('/actors', headers=token_ca)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['X-Total-Count'], '0')
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn('X-Total-Count', second.headers)
+        self.assertEqual(head.status_code, 200)
+
+    def test_head_actors_not_served_from_cache(self):
+        first = self.client().get('/actors?limit=1', headers=token_ca)
+        after = '/actors?limit=1&after={}'.format(json.loads(first.data)['next'])
+        self.client().get(after, headers=token_ca)
+        res = self.client().head(after, headers=token_ca)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(res.headers['X-Total-Count'], str(Actor.query.count()))
+
+    def test_stream_actors_after_cursor_has_no_total_count(self):
+        first = self.client().get('/actors?limit=1', headers=token_ca)
+        res = self.client().get('/actors?stream=1&after={}'.format(json.loads(first.data)['next']),
+                                headers=token_ca)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Total-Count', res.headers)
+
+    def test_get_actors_total_count_follows_writes(self):
+        first = self.client().get('/actors?limit=1', headers=token_ca)
+        self.client().post('/actors', json=self.new_actor, headers=token_cd)
+        second = self.client().get('/actors?limit=1', headers=token_ca)
+        cached = self.client().get('/actors?limit=1', headers=token_ca)
+
+        self.assertEqual(int(second.headers['X-Total-Count']),
+                         int(first.headers['X-Total-Count']) + 1)
+        self.assertEqual(cached.headers['X-Total-Count'], second.headers['X-Total-Count'])
+
+    def test_get_actors_cache_invalidated_on_write(self):
+        self.client().get('/actors', headers=token_ca)
+        self.client().post('/actors', json=self.new_actor, headers=token_cd)
+        res = self.client().get('/actors', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(response_cache.stats()['entries'], 1)
+        self.assertIn(self.new_actor['name'], [actor['name'] for actor in data['actors']])
+
     def test_404_get_actors_not_found(self):
         Actor.query.delete()
         res = self.client().get('/actors', headers=token_ca)
@@ -81,6 +374,53 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['movies'])
 
+    def test_get_movies_paginated(self):
+        res = self.client().get('/movies?limit=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 1)
+        self.assertTrue(data['next'])
+
+        res = self.client().get(f'/movies?limit=1&after={data["next"]}', headers=token_ca)
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(next_page['movies']), 1)
+        self.assertIsNone(next_page['next'])
+
+    def test_get_movies_streamed(self):
+        res = self.client().get('/movies?stream=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['movies']), Movie.query.count())
+
+    def test_get_movie(self):
+        movie_id = Movie.query.first().id
+        res = self.client().get(f'/movies/{movie_id}', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['movie']['id'], movie_id)
+
+    def test_304_get_movies_not_modified(self):
+        res = self.client().get('/movies', headers=token_ca)
+        etag = res.headers['ETag']
+
+        res = self.client().get('/movies', headers=dict(token_ca, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_movies_filtered_and_sorted(self):
+        res = self.client().get('/movies?year_from=2000&year_to=2020&sort=-year', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['year'] for movie in data['movies']], [2016, 2006])
+
     def test_404_get_movies_not_found(self):
         Movie.query.delete()
         res = self.client().get('/movies', headers=token_ca)
@@ -89,6 +429,14 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+    def test_404_head_movies_empty(self):
+        self.client().delete('/movies?ids={}'.format(
+            ','.join(str(movie.id) for movie in Movie.query.all())), headers=token_ep)
+        res = self.client().head('/movies', headers=token_ca)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertNotIn('X-Total-Count', res.headers)
+
     def test_401_get_movies_unauthorized(self):
         res = self.client().get('/movies', headers='')
         data = json.loads(res.data)
@@ -96,6 +444,381 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
 
+    """
+    Test endpoints cast:
+    """
+    def test_get_movie_cast(self):
+        movie_id = Movie.query.filter_by(title='Suicide Squad').one().id
+        res = self.client().get(f'/movies/{movie_id}/cast', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(actor['role'] for actor in data['cast']), ['Deadshot', 'Harley Quinn'])
+
+    def test_get_actor_movies(self):
+        actor_id = Actor.query.filter_by(name='Will Smith').one().id
+        res = self.client().get(f'/actors/{actor_id}/movies', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 2)
+
+    def test_get_movies_include_cast(self):
+        res = self.client().get('/movies?include=cast', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([len(movie['cast']) for movie in data['movies']], [1, 2])
+
+        res = self.client().get('/actors?include=cast&stream=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([len(actor['cast']) for actor in data['actors']], [2, 1])
+
+    def test_get_actors_fields(self):
+        res = self.client().get('/actors?fields=name,id&sort=-age', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([sorted(actor) for actor in data['actors']], [['id', 'name']] * 2)
+
+        res = self.client().get('/movies?fields=title&include=cast&stream=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(data['movies'][0]), ['cast', 'title'])
+
+    def test_get_actor_fields(self):
+        actor_id = Actor.query.first().id
+        res = self.client().get(f'/actors/{actor_id}?fields=age', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(data['actor']), ['age'])
+
+    def test_get_actors_fast_path_matches_jsonify(self):
+        Actor(name='Zoë Kravitz', gender='Female', age=35).insert()
+        Actor(name='Tab\tand \x7f', gender=None, age=None).insert()
+        with self.app.test_request_context():
+            expected = jsonify({
+                'success': True,
+                'actors': [actor.format() for actor in Actor.query.order_by(Actor.id)],
+                'next': None
+            }).data
+
+        res = self.client().get('/actors', headers=token_ca)
+        self.assertEqual(res.data, expected)
+
+        orjson = serializers.orjson
+        serializers.orjson = None
+        try:
+            res = self.client().get('/actors?limit=1000', headers=token_ca)
+        finally:
+            serializers.orjson = orjson
+        self.assertEqual(res.data, expected)
+
+    def test_get_movies_fast_path_matches_jsonify(self):
+        with self.app.test_request_context():
+            expected = jsonify({
+                'success': True,
+                'movies': [movie.format() for movie in Movie.query.order_by(Movie.year.desc())][:1],
+                'next': None
+            }).data
+
+        res = self.client().get('/movies?sort=-year&limit=1', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.data, expected.replace(b'"next":null', b'"next":"%s"' % data['next'].encode()))
+
+    def test_400_get_actors_unknown_field(self):
+        res = self.client().get('/actors?fields=id,salary', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+        res = self.client().get('/movies?fields=', headers=token_ca)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_movies_include_cast_is_not_n_plus_one(self):
+        actor_ids = [actor.id for actor in Actor.query.all()]
+        for year in range(2000, 2010):
+            movie = Movie(title='Sequel', year=year)
+            movie.insert()
+            for actor_id in actor_ids:
+                Casting(movie_id=movie.id, actor_id=actor_id, role='Twin').insert()
+
+        res = self.client().get('/movies?include=cast', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 12)
+
+    def test_slow_query_logged(self):
+        threshold = models.slow_query_threshold
+        models.slow_query_threshold = 0
+        try:
+            with self.assertLogs('models', 'WARNING') as logs:
+                self.client().get('/actors?limit=1', headers=token_ca)
+        finally:
+            models.slow_query_threshold = threshold
+
+        self.assertIn('GET /actors?limit=1', logs.output[-1])
+        self.assertIn('FROM actors', logs.output[-1])
+
+    def test_query_budget_exceeded(self):
+        self.app.config['PROPAGATE_EXCEPTIONS'] = True
+        self.app.config['QUERY_BUDGETS'] = dict(QUERY_BUDGETS, get_movies=1)
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client().get('/movies', headers=token_ca)
+
+    def test_add_and_delete_casting(self):
+        movie_id = Movie.query.first().id
+        actor_id = Actor.query.filter_by(name='Margot Robbie').one().id
+        res = self.client().post(f'/movies/{movie_id}/cast', json={'actor_id': actor_id, 'role': 'Linda'}, headers=token_cd)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Casting.query.get((movie_id, actor_id)).role, 'Linda')
+
+        res = self.client().delete(f'/movies/{movie_id}/cast/{actor_id}', headers=token_cd)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(Casting.query.get((movie_id, actor_id)))
+
+    def test_delete_actor_removes_castings(self):
+        actor_id = Actor.query.filter_by(name='Will Smith').one().id
+        self.client().delete(f'/actors/{actor_id}', headers=token_cd)
+
+        self.assertEqual(Casting.query.filter_by(actor_id=actor_id).count(), 0)
+
+    def test_401_add_casting_unauthorized(self):
+        res = self.client().post('/movies/1/cast', json={'actor_id': 2}, headers=token_ca)
+
+        self.assertEqual(res.status_code, 401)
+
+    """
+    Test timings and metrics:
+    """
+    def test_server_timing_header(self):
+        res = self.client().get('/actors?limit=1', headers=token_ca)
+        phases = dict(part.split(';dur=') for part in res.headers['Server-Timing'].split(', '))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(phases), ['app', 'auth', 'db', 'serialize', 'total'])
+        self.assertGreater(float(phases['db']), 0)
+
+    def test_metrics(self):
+        self.client().get('/actors', headers=token_ca)
+        res = self.client().get('/metrics')
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('madb_requests_total{route="/actors",method="GET",status="200"}', text)
+        self.assertIn('madb_request_duration_seconds_bucket{route="/actors",method="GET",le="+Inf"}', text)
+        self.assertIn('madb_request_phase_seconds_total{route="/actors",method="GET",phase="auth"}', text)
+        self.assertIn('madb_response_cache_hits_total', text)
+        self.assertIn('madb_sql_statements_total{route="/actors",method="GET"}', text)
+
+    def test_gzip_response(self):
+        models.bulk_insert(Actor, [dict(self.new_actor, name='Clone {}'.format(i)) for i in range(100)])
+        res = self.client().get('/actors?limit=200', headers=dict(token_ca, **{'Accept-Encoding': 'br;q=0, gzip'}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(res.data))['actors']), 102)
+        self.assertIn('compress;dur=', res.headers['Server-Timing'])
+        self.assertIn('madb_compression_ratio{encoding="gzip"}', self.client().get('/metrics').data.decode())
+
+        res = self.client().get('/actors?stream=1', headers=dict(token_ca, **{'Accept-Encoding': 'gzip'}))
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(res.data))['actors']), 102)
+
+    def test_small_response_not_compressed(self):
+        res = self.client().get('/actors?limit=1', headers=dict(token_ca, **{'Accept-Encoding': 'gzip'}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertTrue(json.loads(res.data)['success'])
+
+    def replica_app(self, replica_path):
+        return create_app(dict(TEST_CONFIG, DATABASE_REPLICA_URLS=['sqlite:///' + replica_path]))
+
+    def copy_to_replica(self):
+        replica_path = os.path.join(tempfile.mkdtemp(), 'replica.db')
+        # the committed data only, like a replica that is up to date
+        source, target = sqlite3.connect(database_file), sqlite3.connect(replica_path)
+        source.backup(target)
+        source.close()
+        target.close()
+        return replica_path
+
+    def test_reads_routed_to_replica(self):
+        replica_path = self.copy_to_replica()
+        # written to the primary only, as if the replica lagged behind
+        Actor(name='Lagging', gender='Female', age=40).insert()
+        client = self.replica_app(replica_path).test_client()
+
+        res = client.get('/actors?fields=name', headers=token_ca)
+        self.assertNotIn('Lagging', [actor['name'] for actor in json.loads(res.data)['actors']])
+
+        res = client.post('/actors', json=self.new_actor, headers=token_cd)
+        self.assertIn('madb_primary=1', res.headers['Set-Cookie'])
+
+        # read your writes: pinned to the primary
+        res = client.get('/actors?fields=name', headers=token_ca)
+        self.assertIn('Lagging', [actor['name'] for actor in json.loads(res.data)['actors']])
+
+    def test_statement_errors_leave_replica_healthy(self):
+        app = self.replica_app(self.copy_to_replica())
+        self.assertTrue(replica_router.healthy(app, 'replica_0'))
+        engine = db.get_engine(app, 'replica_0')
+
+        with self.assertRaises(IntegrityError):
+            engine.execute(Actor.__table__.insert(), id=Actor.query.first().id, name='Duplicate')
+
+        self.assertTrue(replica_router.health[engine][1])
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        replica_path = os.path.join(tempfile.mkdtemp(), 'missing', 'replica.db')
+        Actor(name='Primary Only', gender='Male', age=40).insert()
+        client = self.replica_app(replica_path).test_client()
+
+        with self.assertLogs('replicas', 'WARNING'):
+            res = client.get('/actors?fields=name', headers=token_ca)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Primary Only', [actor['name'] for actor in json.loads(res.data)['actors']])
+
+    def test_export_and_import_ndjson(self):
+        path = os.path.join(tempfile.mkdtemp(), 'actors.ndjson')
+        expected = [actor.format() for actor in Actor.query.order_by(Actor.id)]
+
+        self.assertEqual(transfer.export_file('actors', path, out=io.StringIO()), len(expected))
+        with open(path) as file:
+            self.assertEqual([json.loads(line) for line in file], expected)
+
+        Actor.query.delete()
+        db.session.commit()
+        self.assertEqual(transfer.import_file('actors', path, out=io.StringIO()), len(expected))
+        self.assertEqual([actor.format() for actor in Actor.query.order_by(Actor.id)], expected)
+
+    def test_import_csv_resumes_after_last_chunk(self):
+        path = os.path.join(tempfile.mkdtemp(), 'actors.csv')
+        rows = ['name,gender,age'] + ['Extra {},Female,{}'.format(i, 20 + i) for i in range(5)]
+        with open(path, 'w') as file:
+            file.write('\n'.join(rows[:4] + ['Broken,Male,old'] + rows[5:]) + '\n')
+        count = Actor.query.count()
+
+        with self.assertRaises(ValueError):
+            transfer.import_file('actors', path, chunk_size=2, out=io.StringIO())
+        self.assertEqual(Actor.query.count(), count + 2)
+
+        with open(path, 'w') as file:
+            file.write('\n'.join(rows) + '\n')
+        self.assertEqual(transfer.import_file('actors', path, chunk_size=2, out=io.StringIO()), 3)
+        self.assertEqual(Actor.query.filter(Actor.name.like('Extra %')).count(), 5)
+        self.assertEqual(models.ImportCheckpoint.query.count(), 0)
+
+    def test_503_when_overloaded(self):
+        limiter.configure(max_in_flight=1, queue_size=0)
+        self.assertTrue(limiter.try_acquire('/held'))
+        try:
+            res = self.client().get('/actors', headers=token_ca)
+            data = json.loads(res.data)
+            text = self.client().get('/metrics').data.decode()
+        finally:
+            limiter.release('/held')
+            limiter.configure(self.app.config['ADMISSION_MAX_IN_FLIGHT'],
+                              self.app.config['ADMISSION_QUEUE_SIZE'])
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertIn('madb_admission_shed_total{route="/actors",reason="queue_full"}', text)
+
+    """
+    Test endpoint search:
+    """
+    def test_search(self):
+        res = self.client().get('/search?q=smith', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['hits'][0]['type'], 'actor')
+        self.assertEqual(data['hits'][0]['actor']['name'], 'Will Smith')
+
+    def test_search_follows_writes(self):
+        actor = Actor.query.filter_by(name='Will Smith').one()
+        actor.name = 'Jaden Smith'
+        actor.update()
+        Movie(title='Smith Goes to Washington', year=1939).insert()
+
+        res = self.client().get('/search?q=smith&limit=1', headers=token_ca)
+        data = json.loads(res.data)
+        res = self.client().get(f'/search?q=smith&limit=1&after={data["next"]}', headers=token_ca)
+        next_page = json.loads(res.data)
+
+        hits = data['hits'] + next_page['hits']
+        self.assertEqual(sorted(hit['type'] for hit in hits), ['actor', 'movie'])
+        self.assertIsNone(next_page['next'])
+
+        actor.delete()
+        res = self.client().get('/search?q=jaden', headers=token_ca)
+        self.assertEqual(res.status_code, 404)
+
+    """
+    Test endpoint stats:
+    """
+    def test_stats(self):
+        res = self.client().get('/stats', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['stats']['actors']['total'], Actor.query.count())
+        self.assertEqual(data['stats']['movies']['total'], Movie.query.count())
+        self.assertEqual(sum(bucket['count'] for bucket in data['stats']['actors']['by_age']),
+                         Actor.query.count())
+        self.assertIn({'age_from': 50, 'age_to': 59, 'count': 1}, data['stats']['actors']['by_age'])
+        self.assertIn({'gender': 'Male', 'count': 1}, data['stats']['actors']['by_gender'])
+
+    def test_stats_follow_writes(self):
+        actor_id = Actor.query.first().id
+        movie_ids = [movie.id for movie in Movie.query.all()]
+        self.client().post('/actors', json=self.new_actor, headers=token_cd)
+        self.client().patch(f'/actors/{actor_id}', json={'age': None, 'gender': 'Female'},
+                            headers=token_cd)
+        self.client().patch('/movies', json=[{'id': movie_ids[0], 'year': 1999}],
+                            headers=token_cd)
+        self.client().delete(f'/movies?ids={movie_ids[1]}', headers=token_ep)
+        Movie(title='Sun Wars', year=None).insert()
+
+        res = self.client().get('/stats', headers=token_ca)
+        stats = json.loads(res.data)['stats']
+        models.rebuild_stats()
+
+        self.assertEqual(stats, models.catalog_stats())
+        self.assertEqual(stats['movies']['by_year'],
+                         [{'year': None, 'count': 1}, {'year': 1999, 'count': 1}])
+        self.assertEqual(stats['actors']['by_age'][0], {'age_from': None, 'age_to': None, 'count': 1})
+
+    def test_401_stats_without_token(self):
+        res = self.client().get('/stats')
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_400_search_without_query(self):
+        res = self.client().get('/search?q=', headers=token_ca)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     """
     Test endpoints POST:
     """
@@ -114,6 +837,34 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    def test_add_actors_batch(self):
+        actors = [self.new_actor, dict(self.new_actor, name='Luke Skywalker')]
+        res = self.client().post('/actors/batch', json=actors, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['actors']), 2)
+        self.assertEqual(Actor.query.get(data['actors'][1]).name, 'Luke Skywalker')
+
+    def test_400_add_actors_batch_invalid_item(self):
+        count = Actor.query.count()
+        actors = [self.new_actor, {'name': 'No Age', 'gender': 'Male'}]
+        res = self.client().post('/actors/batch', json=actors, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Actor.query.count(), count)
+
+    def test_413_add_actors_batch_too_large(self):
+        actors = [self.new_actor] * (self.app.config['MAX_BATCH_SIZE'] + 1)
+        res = self.client().post('/actors/batch', json=actors, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 413)
+        self.assertEqual(data['success'], False)
+
     def test_401_add_actor_unauthorized(self):
         res = self.client().get('/actors', json=self.new_actor, headers='')
         data = json.loads(res.data)
@@ -136,6 +887,15 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    def test_add_movies_batch(self):
+        movies = [self.new_movie, dict(self.new_movie, title='Sun Wars II')]
+        res = self.client().post('/movies/batch', json=movies, headers=token_ep)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['movies']), 2)
+
     def test_401_add_movie_unauthorized(self):
         res = self.client().get('/movies', json=self.new_movie, headers='')    
         data = json.loads(res.data)
@@ -155,6 +915,57 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data['actor'])
         self.assertEqual(data['actor']['age'], 100)
 
+    def test_update_actor_only_sent_fields(self):
+        actor = Actor.query.first()
+        expected = dict(actor.format(), age=52)
+        res = self.client().patch(f'/actors/{actor.id}', json={'age': 52}, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actor'], expected)
+
+    def test_400_update_actor_body_not_an_object(self):
+        actor = Actor.query.first()
+        res = self.client().patch(f'/actors/{actor.id}', json=['age'], headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Actor.query.get(actor.id).format(), actor.format())
+
+    def test_404_update_movie_not_found(self):
+        res = self.client().patch('/movies/999999', json=self.new_movie, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Movie.query.filter_by(title='Sun Wars').count(), 0)
+
+    def test_update_actors_batch(self):
+        actor_ids = [actor.id for actor in Actor.query.order_by(Actor.id)]
+        items = [{'id': actor_ids[0], 'age': 52},
+                 {'id': actor_ids[1], 'age': 30, 'name': 'Margot E. Robbie'},
+                 {'id': 999999, 'age': 1}]
+        res = self.client().patch('/actors', json=items, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['status'] for actor in data['actors']],
+                         ['updated', 'updated', 'not_found'])
+        self.assertEqual(Actor.query.get(actor_ids[0]).age, 52)
+        self.assertEqual(Actor.query.get(actor_ids[0]).name, 'Will Smith')
+        self.assertEqual(Actor.query.get(actor_ids[1]).name, 'Margot E. Robbie')
+
+    def test_400_update_movies_batch_invalid_item(self):
+        movie_id = Movie.query.first().id
+        items = [{'id': movie_id, 'year': 2000}, {'id': movie_id, 'rating': 5}]
+        res = self.client().patch('/movies', json=items, headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertNotEqual(Movie.query.get(movie_id).year, 2000)
+
     def test_401_update_actor_unauthorized(self):
         res = self.client().patch('/actors/1', json=self.new_actor, headers=token_ca)
         data = json.loads(res.data)
@@ -171,6 +982,13 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data['movie'])
         self.assertEqual(data['movie']['year'], 1920)
 
+    def test_400_update_movie_body_not_an_object(self):
+        res = self.client().patch('/movies/1', json='Sun Wars', headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_401_update_movie_unauthorized(self):
         res = self.client().patch('/movies/1', json=self.new_movie, headers=token_ca)
         data = json.loads(res.data)
@@ -197,6 +1015,31 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+    def test_delete_movies_batch(self):
+        movie_ids = [movie.id for movie in Movie.query.all()]
+        ids = ','.join(str(movie_id) for movie_id in movie_ids + [999999])
+        res = self.client().delete(f'/movies?ids={ids}', headers=token_ep)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['status'] for movie in data['movies']],
+                         ['deleted'] * len(movie_ids) + ['not_found'])
+        self.assertEqual(Movie.query.count(), 0)
+        self.assertEqual(Casting.query.count(), 0)
+
+    def test_400_delete_actors_batch_malformed_ids(self):
+        res = self.client().delete('/actors?ids=1,two', headers=token_cd)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_413_delete_actors_batch_too_large(self):
+        ids = ','.join(str(i) for i in range(self.app.config['MAX_BATCH_SIZE'] + 1))
+        res = self.client().delete(f'/actors?ids={ids}', headers=token_cd)
+
+        self.assertEqual(res.status_code, 413)
+
     def test_401_delete_actor_unauthorized(self):
         actor_id = Actor.query.first().id
         res = self.client().delete(f'/actors/{actor_id}', headers=token_ca)
@@ -252,6 +1095,308 @@ class CastingAgencyTestCase(unittest.TestCase):
 
 
 
+class ConcurrentWriteTestCase(unittest.TestCase):
+    """This class represents the concurrent write test case, on a database
+    file of its own since every thread needs its own connection"""
+    def setUp(self):
+        self.database_fd, self.database_file = tempfile.mkstemp(prefix='madb-test-', suffix='.db')
+        self.app = create_app(dict(TEST_CONFIG,
+                                   SQLALCHEMY_DATABASE_URI='sqlite:///' + self.database_file))
+        with self.app.app_context():
+            db.create_all()
+            db_test_data()
+            db.session.remove()
+
+    def tearDown(self):
+        db.get_engine(self.app).dispose()
+        os.close(self.database_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.database_file + suffix):
+                os.remove(self.database_file + suffix)
+
+    def run_concurrently(self, calls):
+        barrier = threading.Barrier(len(calls))
+        results = []
+
+        def run(call):
+            with self.app.app_context():
+                barrier.wait()
+                try:
+                    results.append(call())
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assert_stats_match_tables(self):
+        with self.app.app_context():
+            stats = models.catalog_stats()
+            models.rebuild_stats()
+            self.assertEqual(stats, models.catalog_stats())
+            db.session.remove()
+
+    def test_concurrent_deletes_counted_once(self):
+        with self.app.app_context():
+            actor_id = Actor.query.first().id
+            db.session.remove()
+        results = self.run_concurrently(
+            [lambda: models.delete_rows(Actor, [actor_id])] * 4 +
+            [lambda: models.delete_row(Actor, actor_id)] * 4)
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len([result for result in results if result]), 1)
+        self.assert_stats_match_tables()
+
+    def test_concurrent_updates_counted_once(self):
+        with self.app.app_context():
+            actor_id = Actor.query.first().id
+            db.session.remove()
+        results = self.run_concurrently(
+            [lambda age=age: models.update_row(Actor, actor_id, {'age': age})
+             for age in range(20, 80, 10)] +
+            [lambda: models.update_rows(Actor, [{'id': actor_id, 'gender': 'Female'}])] * 2)
+
+        self.assertEqual(len(results), 8)
+        self.assert_stats_match_tables()
+
+
+class JWKSStub(HTTPServer):
+    """Local stand-in for the Auth0 JWKS endpoint"""
+    def __init__(self):
+        self.requests = 0
+        self.fail = False
+        self.delay = 0
+        self.cache_control = None
+        self.jwks = {'keys': [self.key('key-1')]}
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                if stub.fail:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                if stub.cache_control:
+                    self.send_header('Cache-Control', stub.cache_control)
+                self.end_headers()
+                self.wfile.write(json.dumps(stub.jwks).encode())
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+            self.server_port)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def key(kid):
+        return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'}
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+    def setUp(self):
+        self.stub = JWKSStub()
+        self.store = JWKSStore(url=self.stub.url, ttl=600,
+                               min_refresh_interval=0)
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+
+    def test_keys_are_cached(self):
+        for _ in range(5):
+            self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_cache_control_max_age(self):
+        self.stub.cache_control = 'public, max-age=0'
+        self.store.get_key('key-1')
+        self.store.get_key('key-1')
+        self.store.background.join()
+
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_expired_keys_refreshed_in_background(self):
+        self.store.get_key('key-1')
+        self.stub.delay = 0.5
+        self.store._expires_at = 0
+        durations = []
+
+        def get_key():
+            start = time.monotonic()
+            self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+            durations.append(time.monotonic() - start)
+
+        threads = [threading.Thread(target=get_key) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.store.background.join()
+
+        self.assertEqual(len(durations), 8)
+        self.assertLess(max(durations), 0.25)
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_unknown_kid_refreshes_once(self):
+        self.store.get_key('key-1')
+        self.stub.jwks['keys'].append(JWKSStub.key('key-2'))
+        threads = [threading.Thread(target=self.store.get_key, args=('key-2',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_stale_keys_served_when_refresh_fails(self):
+        self.store.get_key('key-1')
+        self.stub.fail = True
+        self.store._expires_at = 0
+
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.store.background.join()
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.stub.requests, 2)
+
+
+class AdmissionLimiterTestCase(unittest.TestCase):
+    """This class represents the admission control test case"""
+    def setUp(self):
+        self.limiter = AdmissionLimiter(max_in_flight=1, queue_size=2)
+        self.results = []
+
+    def queue(self, route, priority):
+        def run():
+            self.results.append((route, self.limiter.acquire(route, priority, timeout=5)))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while thread.is_alive() and route not in [waiter.route for waiter in self.limiter.waiters]:
+            time.sleep(0.001)
+        return thread
+
+    def test_reads_let_in_before_writes(self):
+        self.assertTrue(self.limiter.try_acquire('/held'))
+        write = self.queue('/actors/<int:actor_id>', 1)
+        read = self.queue('/actors', 0)
+
+        self.limiter.release('/held')
+        read.join()
+        self.assertEqual(self.results, [('/actors', True)])
+
+        self.limiter.release('/actors')
+        write.join()
+        self.assertEqual(self.results[1], ('/actors/<int:actor_id>', True))
+
+    def test_full_queue_sheds_writes_first(self):
+        self.assertTrue(self.limiter.try_acquire('/held'))
+        writes = [self.queue('/actors', 1), self.queue('/movies', 1)]
+        read = self.queue('/search', 0)
+        writes[1].join()
+
+        self.assertEqual(self.results, [('/movies', False)])
+        self.assertEqual(self.limiter.shed, {('/movies', 'evicted'): 1})
+        self.assertFalse(self.limiter.acquire('/movies', 1, timeout=5))
+
+        self.limiter.release('/held')
+        read.join()
+        self.limiter.release('/search')
+        writes[0].join()
+        self.assertEqual(self.results[1:], [('/search', True), ('/actors', True)])
+
+    def test_route_limit(self):
+        self.limiter.configure(max_in_flight=10, queue_size=0)
+        self.assertTrue(self.limiter.try_acquire('/actors', limit=1))
+        self.assertFalse(self.limiter.acquire('/actors', limit=1, timeout=5))
+        self.assertTrue(self.limiter.try_acquire('/movies', limit=1))
+
+
+class LRUBackendTestCase(unittest.TestCase):
+    """This class represents the response cache backend test case"""
+    def setUp(self):
+        self.backend = LRUBackend(max_entries=2, max_bytes=10)
+
+    def value(self, body):
+        return {'status': 200, 'mimetype': 'application/json', 'body': body}
+
+    def test_evicts_least_recently_used(self):
+        self.backend.set('a', self.value('1'), ('actors',), 60)
+        self.backend.set('b', self.value('2'), ('movies',), 60)
+        self.backend.get('a')
+        self.backend.set('c', self.value('3'), ('movies',), 60)
+
+        self.assertIsNotNone(self.backend.get('a'))
+        self.assertIsNone(self.backend.get('b'))
+        self.assertEqual(self.backend.stats()['evictions'], 1)
+
+    def test_evicts_above_max_bytes(self):
+        self.backend.set('a', self.value('123456'), ('actors',), 60)
+        self.backend.set('b', self.value('123456'), ('actors',), 60)
+
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.stats()['bytes'], 6)
+
+    def test_invalidate_drops_tagged_entries_only(self):
+        self.backend.set('a', self.value('1'), ('actors', 'castings'), 60)
+        self.backend.set('b', self.value('2'), ('movies',), 60)
+        self.backend.invalidate('actors')
+
+        self.assertIsNone(self.backend.get('a'))
+        self.assertIsNotNone(self.backend.get('b'))
+
+    def test_expired_entry_is_a_miss(self):
+        self.backend.set('a', self.value('1'), ('actors',), 0)
+
+        self.assertIsNone(self.backend.get('a'))
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.payload = {'exp': time.time() + 60, 'permissions': []}
+
+    def test_hit_after_set(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.set('token', self.payload)
+
+        self.assertEqual(self.cache.get('token'), self.payload)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_expired_token_is_a_miss(self):
+        self.cache.set('token', {'exp': time.time() - 1})
+
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', self.payload)
+        self.cache.set('b', self.payload)
+        self.cache.get('a')
+        self.cache.set('c', self.payload)
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,253 @@
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+from sqlalchemy import func, select
+from batch import ACTOR_FIELDS, MOVIE_FIELDS
+from models import db, adjust_stats, bump_table_version, Actor, Movie, ImportCheckpoint
+
+TABLES = {'actors': (Actor, ACTOR_FIELDS), 'movies': (Movie, MOVIE_FIELDS)}
+FORMATS = ('csv', 'ndjson')
+
+'''
+file_format(path, fmt=None)
+    fmt when given, otherwise guessed from the extension of path
+'''
+def file_format(path, fmt=None):
+    if fmt is not None:
+        return fmt
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise ValueError('Unknown format of {}, use --format csv or ndjson'.format(path))
+
+'''
+Progress
+    one-line progress readout (rows, percentage of the file, rows per
+    second) rewritten in place after every chunk
+'''
+class Progress:
+    def __init__(self, label, total_bytes=None, out=sys.stderr):
+        self.label = label
+        self.total_bytes = total_bytes
+        self.out = out
+        self.start = time.monotonic()
+
+    def update(self, rows, new_rows, position=None):
+        rate = new_rows / max(time.monotonic() - self.start, 1e-9)
+        text = '{}: {} rows'.format(self.label, rows)
+        if self.total_bytes and position is not None:
+            text += ' ({:.1f}%)'.format(100 * position / self.total_bytes)
+        self.out.write('\r{}, {:.0f} rows/s'.format(text, rate))
+        self.out.flush()
+
+    def done(self):
+        self.out.write('\n')
+        self.out.flush()
+
+'''
+_Lines
+    lines of a file opened in binary mode, decoded, keeping the byte
+    position of the end of the last line read so every record can be
+    tied to where the next one starts
+'''
+class _Lines:
+    def __init__(self, file, position=0):
+        self.file = file
+        self.position = position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.position += len(line)
+        return line.decode('utf-8')
+
+'''
+_csv_records(file, position) / _ndjson_records(file, position)
+    (record dict, byte position after it) for every record of file,
+    starting at position
+    csv.reader pulls lines one at a time, so quoted fields spanning
+    several lines still end at the right position
+'''
+def _csv_records(file, position):
+    lines = _Lines(file)
+    header = next(csv.reader(lines), None)
+    if header is None:
+        return
+    if position > lines.position:
+        file.seek(position)
+        lines.position = position
+
+    for values in csv.reader(lines):
+        if values:
+            yield dict(zip(header, values)), lines.position
+
+def _ndjson_records(file, position):
+    file.seek(position)
+    lines = _Lines(file, position)
+    for line in lines:
+        if line.strip():
+            yield json.loads(line), lines.position
+
+READERS = {'csv': _csv_records, 'ndjson': _ndjson_records}
+
+'''
+_row(record, fields)
+    column dict of one imported record, converting CSV text to ints
+    empty values are NULL, id is optional and assigned by the database
+    when missing
+'''
+def _row(record, fields):
+    if not isinstance(record, dict):
+        raise ValueError('not an object')
+
+    row = {}
+    for field, kind in dict(fields, id=int).items():
+        value = record.get(field)
+        if value == '':
+            value = None
+        if value is not None:
+            if kind is int and isinstance(value, str):
+                value = int(value)
+            elif isinstance(value, bool) or not isinstance(value, kind):
+                raise ValueError('{} must be {}'.format(field, kind.__name__))
+        row[field] = value
+
+    if row['id'] is None:
+        del row['id']
+    return row
+
+'''
+_insert(table, rows)
+    one executemany INSERT per set of columns (with or without id)
+'''
+def _insert(table, rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    for group in groups.values():
+        db.session.execute(table.insert(), group)
+
+'''
+_reset_sequence(table)
+    moves the id sequence of table past the imported ids on Postgres,
+    where explicit ids don't advance it
+'''
+def _reset_sequence(table):
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    db.session.execute(
+        select([func.setval(func.pg_get_serial_sequence(table.name, 'id'),
+                            func.coalesce(func.max(table.c.id), 0) + 1, False)]))
+    db.session.commit()
+
+'''
+import_file(name, path, fmt=None, chunk_size=10000, restart=False, out=sys.stderr)
+    streams actors or movies from a CSV or NDJSON file into the database
+    chunk_size records at a time, each chunk inserted in bulk and
+    committed with the checkpoint of the import, so memory use doesn't
+    depend on the size of the file
+    an interrupted import resumes after its last committed chunk, unless
+    restart is set
+    returns the number of rows imported by this run
+'''
+def import_file(name, path, fmt=None, chunk_size=10000, restart=False, out=sys.stderr):
+    model, fields = TABLES[name]
+    table = model.__table__
+    read = READERS[file_format(path, fmt)]
+    size = os.path.getsize(path)
+
+    source = '{}:{}'.format(name, os.path.abspath(path))
+    checkpoint = ImportCheckpoint.query.get(source)
+    if checkpoint is None or restart:
+        checkpoint = db.session.merge(ImportCheckpoint(source=source, position=0, rows=0))
+    elif checkpoint.position > size:
+        raise ValueError('{} is smaller than when it was imported, use --restart'.format(path))
+    elif checkpoint.position:
+        out.write('Resuming {} after {} rows\n'.format(path, checkpoint.rows))
+
+    progress = Progress('{} -> {}'.format(path, name), size, out)
+    imported = 0
+    with open(path, 'rb') as file:
+        records = read(file, checkpoint.position)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+
+            rows = []
+            for i, (record, position) in enumerate(chunk):
+                try:
+                    rows.append(_row(record, fields))
+                except (ValueError, TypeError) as e:
+                    db.session.rollback()
+                    raise ValueError('{}: record {}: {}'.format(
+                        path, checkpoint.rows + i + 1, e))
+
+            _insert(table, rows)
+            adjust_stats(name, new_rows=rows)
+            checkpoint.position = chunk[-1][1]
+            checkpoint.rows += len(rows)
+            bump_table_version(name)
+            db.session.commit()
+
+            imported += len(rows)
+            progress.update(checkpoint.rows, imported, checkpoint.position)
+
+    progress.done()
+    db.session.delete(checkpoint)
+    db.session.commit()
+    _reset_sequence(table)
+    return imported
+
+'''
+export_file(name, path, fmt=None, chunk_size=10000, out=sys.stderr)
+    streams every actor or movie, ordered by id, to a CSV or NDJSON file
+    ('-' for stdout) with the fields format() returns
+    rows are fetched chunk_size at a time from a server-side cursor where
+    the backend has one
+    returns the number of rows exported
+'''
+def export_file(name, path, fmt=None, chunk_size=10000, out=sys.stderr):
+    model, fields = TABLES[name]
+    table = model.__table__
+    fmt = 'ndjson' if path == '-' and fmt is None else file_format(path, fmt)
+    columns = ['id'] + list(fields)
+
+    target = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+    progress = Progress('{} -> {}'.format(name, path), out=out)
+    exported = 0
+    try:
+        writer = csv.writer(target)
+        if fmt == 'csv':
+            writer.writerow(columns)
+
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(
+                select([table.c[column] for column in columns]).order_by(table.c.id))
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if fmt == 'csv':
+                    writer.writerows(rows)
+                else:
+                    target.write(''.join(
+                        json.dumps(dict(zip(columns, row))) + '\n' for row in rows))
+                exported += len(rows)
+                progress.update(exported, exported)
+    finally:
+        if target is not sys.stdout:
+            target.close()
+
+    progress.done()
+    return exported